@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    import pyaudio
+
+# configuration #####
+DEVICE_CACHE_PATH: Path = Path.home() / '.cache' / 'vatis-streams-samples' / 'input-devices.json'
+# configuration end #####
+
+
+def create_wav_headers(channels: int, sample_rate: int, sample_width: int) -> bytes:
+    import wave
+    import io
+
+    buffer = io.BytesIO()
+
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.setnframes(0)
+
+    return buffer.getvalue()
+
+
+def initialize_audio() -> 'Future[pyaudio.PyAudio]':
+    """
+    Initializes PortAudio in the background. It enumerates the devices, so with a known input device it overlaps with
+    the connection instead of delaying it.
+    """
+    from concurrent.futures import Future
+
+    audio: Future = Future()
+
+    def _initialize():
+        try:
+            import pyaudio
+
+            audio.set_result(pyaudio.PyAudio())
+        except Exception as e:
+            audio.set_exception(e)
+
+    threading.Thread(target=_initialize, name='audio-init', daemon=True).start()
+
+    return audio
+
+
+def list_input_devices(pa: 'pyaudio.PyAudio') -> Tuple[List[dict], Optional[int]]:
+    info = pa.get_host_api_info_by_index(0)
+    numdevices: int = info.get('deviceCount')
+
+    try:
+        default_input_device_index: Optional[int] = pa.get_default_input_device_info().get('index')
+    except IOError:
+        default_input_device_index = None
+
+    devices: List[dict] = []
+
+    # query each device only once
+    for i in range(0, numdevices):
+        device_info: dict = pa.get_device_info_by_index(i)
+
+        if device_info.get('maxInputChannels') > 0:
+            devices.append({'index': i, 'name': device_info.get('name')})
+
+    return devices, default_input_device_index
+
+
+def load_input_devices(pa: 'pyaudio.PyAudio', refresh: bool = False) -> Tuple[List[dict], Optional[int]]:
+    device_count: int = pa.get_host_api_info_by_index(0).get('deviceCount')
+
+    # the cache is stale when a device was attached or detached since it was written
+    if not refresh and DEVICE_CACHE_PATH.is_file():
+        try:
+            cache: dict = json.loads(DEVICE_CACHE_PATH.read_text())
+
+            if cache['deviceCount'] == device_count:
+                return cache['devices'], cache['default']
+        except (ValueError, KeyError):
+            pass
+
+    devices, default_input_device_index = list_input_devices(pa)
+
+    try:
+        DEVICE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        DEVICE_CACHE_PATH.write_text(json.dumps({'deviceCount': device_count, 'devices': devices, 'default': default_input_device_index}))
+    except OSError as e:
+        print(f'Could not cache the input devices: {e}')
+
+    return devices, default_input_device_index
+
+
+def select_input_device(audio: 'Future[pyaudio.PyAudio]', refresh: bool = False) -> int:
+    # non-interactive selection, doesn't wait for the audio initialization
+    if os.environ.get('INPUT_DEVICE_INDEX'):
+        return int(os.environ['INPUT_DEVICE_INDEX'])
+
+    pa: pyaudio.PyAudio = audio.result()
+
+    devices, default_input_device_index = load_input_devices(pa, refresh=refresh)
+
+    for device in devices:
+        print("Input Device index ",
+              device['index'],
+              " - ",
+              device['name'],
+              ' (default)' if device['index'] == default_input_device_index else '')
+
+    index = input('Select input device index: ')
+
+    if not index:
+        if default_input_device_index is not None:
+            selected_index: int = default_input_device_index
+        else:
+            raise ValueError('No input device selected')
+    else:
+        selected_index = int(index)
+
+    if refresh:
+        return selected_index
+
+    # validate the cached entry against the live device, re-enumerate if a device was replaced at the same index
+    cached_names: dict = {device['index']: device['name'] for device in devices}
+
+    try:
+        device_info: dict = pa.get_device_info_by_index(selected_index)
+        stale: bool = device_info.get('name') != cached_names.get(selected_index) or device_info.get('maxInputChannels') <= 0
+    except (IOError, ValueError):
+        stale = True
+
+    if stale:
+        print('Input devices changed, refreshing the list')
+        return select_input_device(audio, refresh=True)
+
+    return selected_index
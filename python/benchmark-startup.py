@@ -0,0 +1,186 @@
+import ast
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+# loads the sample under a name other than `__main__`, so only the module level code (imports, configuration) runs. The
+# directory of the sample is importable, as when it is run directly, and the modules given after the script are
+# imported too (the dependencies the sample imports inside its functions)
+LOADER: str = (
+    'import importlib, importlib.util, os, sys; '
+    'sys.path.insert(0, os.path.dirname(sys.argv[1])); '
+    'spec = importlib.util.spec_from_file_location("sample", sys.argv[1]); '
+    'module = importlib.util.module_from_spec(spec); '
+    'spec.loader.exec_module(module)\n'
+    'for name in sys.argv[2:]:\n'
+    '    try: importlib.import_module(name)\n'
+    '    except ImportError: print(name)'
+)
+
+
+def deferred_imports(script: Path) -> List[str]:
+    """
+    The modules imported inside the functions of the script, they are paid on the first use instead of at startup.
+    """
+    modules: List[str] = []
+    tree: ast.Module = ast.parse(script.read_text())
+
+    # the shared modules next to the sample defer their imports too
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module and (script.parent / f'{node.module}.py').is_file():
+            modules.extend(deferred_imports(script.parent / f'{node.module}.py'))
+
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+
+        for child in ast.walk(node):
+            if isinstance(child, ast.Import):
+                modules.extend(alias.name for alias in child.names)
+            elif isinstance(child, ast.ImportFrom) and child.module and not child.level:
+                modules.append(child.module)
+
+    return list(dict.fromkeys(modules))
+
+
+def measure(script: Path, modules: List[str]) -> Tuple[float, float, List[Tuple[str, int]], List[str]]:
+    started: float = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', LOADER, str(script), *modules],
+                            capture_output=True,
+                            text=True)
+    wall_time_ms: float = (time.perf_counter() - started) * 1000
+
+    if result.returncode != 0:
+        raise RuntimeError(f'Could not load {script.name}: {result.stderr.strip().splitlines()[-1]}')
+
+    # lines look like: "import time:       123 |        456 |   package.module"
+    top_level: List[Tuple[str, int]] = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+
+        # nested imports are indented, keep only the top level ones
+        if not name[1:].startswith(' '):
+            top_level.append((name.strip(), int(cumulative)))
+
+    import_time_ms: float = sum(cumulative for _, cumulative in top_level) / 1000
+
+    # the loader prints the modules that are not installed
+    return wall_time_ms, import_time_ms, top_level, result.stdout.split()
+
+
+def benchmark(script: Path,
+              runs: int,
+              top: int,
+              baseline: Optional[dict] = None,
+              baseline_imports: Optional[Set[str]] = None,
+              include_deferred: bool = False) -> dict:
+    modules: List[str] = deferred_imports(script) if include_deferred else []
+    wall_times: List[float] = []
+    import_times: List[float] = []
+    slowest: dict = {}
+    missing: List[str] = []
+
+    for _ in range(runs):
+        wall_time_ms, import_time_ms, top_level, missing = measure(script, modules)
+        wall_times.append(wall_time_ms)
+        import_times.append(import_time_ms)
+
+        for name, cumulative in top_level:
+            slowest.setdefault(name, []).append(cumulative / 1000)
+
+    # the interpreter startup and the loader imports are paid by any script, report only what the sample adds
+    slowest_imports: List[Tuple[str, float]] = sorted(((name, statistics.median(times)) for name, times in slowest.items()
+                                                       if name not in (baseline_imports or set())),
+                                                      key=lambda item: item[1],
+                                                      reverse=True)[:top]
+
+    result: dict = {
+        'script': script.name,
+        'runs': runs,
+        'wallTimeMs': round(statistics.median(wall_times) - (baseline['wallTimeMs'] if baseline else 0), 2),
+        'importTimeMs': round(statistics.median(import_times) - (baseline['importTimeMs'] if baseline else 0), 2),
+        'slowestImports': {name: round(time_ms, 2) for name, time_ms in slowest_imports},
+    }
+
+    if include_deferred:
+        result['missingImports'] = missing
+
+    return result
+
+
+def benchmark_baseline(runs: int) -> Tuple[dict, Set[str]]:
+    """
+    Measures an empty script. Returns its result and the modules it imports, which every sample imports too.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        empty_script: Path = Path(directory) / 'empty.py'
+        empty_script.touch()
+
+        imports: Set[str] = {name for name, _ in measure(empty_script, [])[2]}
+
+        return benchmark(empty_script, runs=runs, top=0), imports
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Measure the startup time of the samples using "python -X importtime"')
+    parser.add_argument('scripts', type=str, nargs='*', help='The scripts to measure, defaults to all the samples')
+    parser.add_argument('--runs', '-n', type=int, default=5, help='Number of runs per script, the median is reported')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest top level imports to report')
+    parser.add_argument('--history', type=str, default=None, help='Append the results to this JSON lines file to track them over time')
+    parser.add_argument('--include-deferred', action='store_true',
+                        help='Also import the dependencies the samples import inside their functions (e.g. requests, websocket), '
+                             'to measure the startup up to the first request')
+    args = parser.parse_args()
+
+    if args.scripts:
+        scripts: List[Path] = [Path(script).resolve() for script in args.scripts]
+    else:
+        # the samples are the hyphenated scripts, the other modules are shared code
+        scripts = sorted(path for path in Path(__file__).resolve().parent.glob('*-*.py') if path.name != Path(__file__).name)
+
+    timestamp: str = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    results: List[dict] = []
+
+    baseline, baseline_imports = benchmark_baseline(runs=args.runs)
+
+    print(f'Baseline (empty script): wall {baseline["wallTimeMs"]:.1f} ms, imports {baseline["importTimeMs"]:.1f} ms, subtracted below\n')
+    print(f'{"script":<36} {"wall [ms]":>10} {"imports [ms]":>13}  slowest imports')
+
+    for script in scripts:
+        try:
+            result: dict = benchmark(script,
+                                     runs=args.runs,
+                                     top=args.top,
+                                     baseline=baseline,
+                                     baseline_imports=baseline_imports,
+                                     include_deferred=args.include_deferred)
+        except RuntimeError as e:
+            print(f'{script.name:<36} Error: {e}')
+            continue
+
+        results.append(result)
+
+        slowest_imports: str = ', '.join(f'{name} ({time_ms:.1f})' for name, time_ms in result['slowestImports'].items())
+        print(f'{result["script"]:<36} {result["wallTimeMs"]:>10.1f} {result["importTimeMs"]:>13.1f}  {slowest_imports}')
+
+        if result.get('missingImports'):
+            print(f'{"":<36} not installed, not measured: {", ".join(result["missingImports"])}')
+
+    if args.history:
+        with open(args.history, 'a') as history:
+            for result in results:
+                history.write(json.dumps({'timestamp': timestamp,
+                                          'python': sys.version.split()[0],
+                                          'baseline': baseline['importTimeMs'],
+                                          'includeDeferred': args.include_deferred,
+                                          **result}) + '\n')
@@ -0,0 +1,179 @@
+import json
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from time import sleep
+from typing import Callable, Dict, Optional
+
+# configuration #####
+POLL_INTERVAL_SECONDS: float = 3
+FALLBACK_POLL_INTERVAL_SECONDS: float = 30  # status polling used only if the webhook doesn't arrive
+# configuration end #####
+
+
+class CompletionListener:
+    """
+    Local server receiving the `webhook.stream.completed`/`webhook.stream.failed` callbacks, which resolves the future
+    registered for each stream with its final state.
+    """
+
+    def __init__(self, webhook_base_url: str, port: int):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.webhook_url: str = f'{webhook_base_url.rstrip("/")}/vatis-callback/'
+        self._futures: Dict[str, Future] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+        listener: CompletionListener = self
+
+        class _WebhookCallbackHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    content_length = int(self.headers['Content-Length'])
+                    webhook_data = json.loads(self.rfile.read(content_length))
+                    stream_id: str = webhook_data['payload']['streamId']
+                    state: str = webhook_data['payload']['state']
+                except (TypeError, ValueError, KeyError):
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.end_headers()
+
+                listener.resolve(stream_id, state)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('', port), _WebhookCallbackHandler)
+
+    def webhook_parameters(self) -> dict:
+        return {
+            'webhook.stream.failed': self.webhook_url,     # callback URL for streams that enter the FAILED state
+            'webhook.stream.completed': self.webhook_url,  # callback URL for streams that enter the COMPLETED state
+        }
+
+    def register(self, stream_id: str) -> Future:
+        """
+        Must be called before the upload, so an early callback is not missed. Returns the same future until the stream
+        is unregistered.
+        """
+        with self._lock:
+            return self._futures.setdefault(stream_id, Future())
+
+    def unregister(self, stream_id: str):
+        with self._lock:
+            self._futures.pop(stream_id, None)
+
+    def resolve(self, stream_id: str, state: str):
+        # only a final state resolves the wait, another state would make it poll the status without pause
+        if state not in ('COMPLETED', 'FAILED'):
+            return
+
+        with self._lock:
+            future: Optional[Future] = self._futures.get(stream_id)
+
+        if future is not None and not future.done():
+            future.set_result(state)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='completion-listener', daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def wait_for_completion(stream_id: str, api_key: str, completed: Optional[Future] = None) -> Optional[str]:
+    """
+    Returns the final state of the stream. With a `completed` future resolved by the webhook, the stream status is
+    checked only when the callback arrives or doesn't arrive in time, otherwise it is polled right away.
+    """
+    import requests
+
+    status_url = f'https://stream-service.vatis.tech/stream-service/api/v1/streams/{stream_id}'
+
+    status_headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Basic {api_key}',
+    }
+
+    while True:
+        webhook_state: Optional[str] = None
+
+        if completed is not None:
+            try:
+                webhook_state = completed.result(timeout=FALLBACK_POLL_INTERVAL_SECONDS)
+            except FutureTimeoutError:
+                pass
+
+            if webhook_state == 'COMPLETED':
+                return webhook_state
+
+        # no webhook yet, or a failure whose details are in the stream status
+        status_response = requests.request('GET', status_url, headers=status_headers)
+
+        if not status_response.ok:
+            print(f'Error on stream status: {status_response.json()}')
+            return None
+
+        if status_response.json()['state'] == 'COMPLETED':
+            return 'COMPLETED'
+        elif status_response.json()['state'] == 'FAILED' or webhook_state == 'FAILED':
+            print(f'Error on stream: {status_response.json()}')
+            return 'FAILED'
+        else:
+            print(f'Waiting for stream to be completed: {stream_id}')
+
+            if completed is None:
+                sleep(POLL_INTERVAL_SECONDS)
+
+
+def export(stream_id: str, api_key: str) -> Optional[dict]:
+    import requests
+
+    # Export the results
+    export_url: str = f"https://export-service.vatis.tech/export-service/api/v1/export/JSON?streams={stream_id}"
+
+    export_headers: dict = {
+        'Authorization': f'Basic {api_key}',
+        'Accept': 'application/json'
+    }
+
+    export_response = requests.request('GET', export_url, headers=export_headers)
+    export_result = export_response.json()
+
+    if not export_response.ok:
+        print(f'Error on export: {export_result}')
+        return None
+
+    return export_result
+
+
+def complete_in_background(stream_id: str,
+                           api_key: str,
+                           completion_listener: Optional[CompletionListener] = None,
+                           export_results: Callable[[str, str], Optional[dict]] = export) -> Future:
+    """
+    Waits for the stream completion in a background thread, then exports the results with `export_results`.
+    The returned future is resolved with `None` if the stream fails.
+    """
+    completed: Optional[Future] = completion_listener.register(stream_id) if completion_listener is not None else None
+    result: Future = Future()
+
+    def _wait_and_export():
+        try:
+            if wait_for_completion(stream_id, api_key, completed) == 'COMPLETED':
+                print(f'The stream is completed: {stream_id}')
+                result.set_result(export_results(stream_id, api_key))
+            else:
+                result.set_result(None)
+        except Exception as e:
+            result.set_exception(e)
+        finally:
+            if completion_listener is not None:
+                completion_listener.unregister(stream_id)
+
+    threading.Thread(target=_wait_and_export, name='stream-waiter', daemon=True).start()
+
+    return result
@@ -1,19 +1,285 @@
 import json
+import re
 import uuid
-from time import sleep
-from typing import Union
+from concurrent.futures import Future
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
 
-import requests
 import os
 import sys
 from pathlib import Path
 
+from stream_completion import CompletionListener, complete_in_background
+
+# configuration #####
+WEBHOOK_BASE_URL: Optional[str] = os.environ.get('WEBHOOK_BASE_URL')  # public URL of the completion listener, polling is used if missing
+WEBHOOK_PORT: int = int(os.environ.get('WEBHOOK_PORT', '8081'))
+# sections of the export to retrieve, the download stops as soon as they are parsed. Empty to retrieve the whole export
+EXPORT_SECTIONS: Tuple[str, ...] = tuple(filter(None, os.environ.get('EXPORT_SECTIONS', 'text').split(',')))
+# path of each section in the export JSON, `*` matches any item of a list
+SECTION_PATHS: Dict[str, Tuple[str, ...]] = {
+    'text': ('enhancedTranscription', 'transcription', 'text'),
+    'words': ('enhancedTranscription', 'transcription', 'words'),
+    'askAnything': ('enhancedTranscription', 'askAnything'),
+}
+EXPORT_CHUNK_SIZE: int = 64 * 1024
+# configuration end #####
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# the body of a string up to its closing quote
+STRING_BODY: str = r'[^"\\]*(?:\\.[^"\\]*)*'
+STRING_END = re.compile(STRING_BODY)
+STRING = re.compile(rf'"{STRING_BODY}"')
+# the characters up to the next bracket or incomplete string, complete strings included
+NON_STRUCTURAL = re.compile(rf'[^"\[\]{{}}]*(?:"{STRING_BODY}"[^"\[\]{{}}]*)*')
+NON_BRACKETS = re.compile(r'[^\[\]{}]+')
+BRACKET_PAIRS = re.compile(r'\[\]|\{\}')
+SCALAR = re.compile(r'[^ \t\n\r,\]}]*')
+
+
+class SectionStreamParser:
+    """
+    Incremental JSON parser that only materializes the values found at the requested paths. Only the objects and
+    arrays leading to them are walked, every other value is skipped by a string and bracket aware scan that keeps
+    nothing of it: its brackets are walked only in the chunks where it starts and ends, and counted in the others.
+    The requested values are collected while scanned and decoded once complete.
+    """
+
+    def __init__(self, paths: Dict[str, Tuple[str, ...]]):
+        self.paths: Dict[Tuple[str, ...], str] = {path: name for name, path in paths.items()}
+        self.prefixes: Set[Tuple[str, ...]] = {path[:length] for path in self.paths for length in range(len(path))}
+
+        self._decoder: json.JSONDecoder = json.JSONDecoder()
+        self._buffer: str = ''
+        self._position: int = 0
+        self._closed: bool = False
+        # one [path, is object, state, key] entry for each open object/array leading to a section
+        self._stack: List[list] = []
+        self._root_done: bool = False
+        # path of the string/object/array being scanned, its nesting and the pieces collected from the previous chunks
+        self._value_path: Optional[Tuple[str, ...]] = None
+        self._depth: int = 0
+        self._in_string: bool = False
+        self._parts: List[str] = []
+
+    def feed(self, data: str) -> Iterator[Tuple[str, object]]:
+        """
+        Consumes the next piece of the document and yields the sections completed by it.
+        """
+        self._buffer = self._buffer[self._position:] + data
+        self._position = 0
+
+        yield from self._parse()
+
+    def close(self) -> Iterator[Tuple[str, object]]:
+        """
+        Parses the data still pending at the end of the document.
+        """
+        self._closed = True
+
+        yield from self.feed('')
+
+    def _parse(self) -> Iterator[Tuple[str, object]]:
+        buffer: str = self._buffer
+        stack: List[list] = self._stack
+        resumed: bool = self._value_path is not None
+
+        while not self._root_done:
+            frame: Optional[list] = stack[-1] if stack else None
+
+            if self._value_path is not None:
+                path: Tuple[str, ...] = self._value_path
+
+                # a value continued from the previous chunks is walked only in the chunk where it ends
+                end: Optional[int] = self._skip_chunk(buffer, self._position) if resumed else None
+                ended: bool = False
+                resumed = False
+
+                if end is None:
+                    end, ended = self._scan(buffer, self._position)
+
+                if path in self.paths:
+                    self._parts.append(buffer[self._position:end])
+
+                if not ended:
+                    self._position = end
+                    return
+
+                self._value_path = None
+
+                if path in self.paths:
+                    value = json.loads(''.join(self._parts))
+                    self._parts.clear()
+
+                    yield self.paths[path], value
+
+                self._end_value(frame, end)
+                continue
+
+            position: int = WHITESPACE.match(buffer, self._position).end()
+
+            if position == len(buffer):
+                self._position = position
+                return
+
+            char: str = buffer[position]
+            state: str = frame[2] if frame else 'value'
+
+            if state in ('first', 'next') and char == ('}' if frame[1] else ']'):
+                stack.pop()
+                self._root_done = not stack
+                self._position = position + 1
+            elif state == 'next' and char == ',':
+                frame[2] = 'key' if frame[1] else 'value'
+                self._position = position + 1
+            elif state in ('first', 'key') and frame[1] and char == '"':
+                try:
+                    frame[3], self._position = self._decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    self._position = position
+                    return
+
+                frame[2] = 'colon'
+            elif state == 'colon' and char == ':':
+                frame[2] = 'value'
+                self._position = position + 1
+            elif state == 'value' or (state == 'first' and not frame[1]):
+                path = () if frame is None else frame[0] + ((frame[3],) if frame[1] else ('*',))
+
+                # walk into the containers leading to a section
+                if path in self.prefixes and char in '{[':
+                    if frame is not None:
+                        frame[2] = 'next'
+
+                    stack.append([path, char == '{', 'first', None])
+                    self._position = position + 1
+                elif char in '"{[':
+                    self._value_path = path
+                    self._depth = 0 if char == '"' else 1
+                    self._in_string = char == '"'
+                    self._position = position + 1
+
+                    if path in self.paths:
+                        self._parts.append(char)
+                else:
+                    end = SCALAR.match(buffer, position).end()
+
+                    # a number at the end of the buffer may continue in the next chunk
+                    if end == len(buffer) and not self._closed:
+                        self._position = position
+                        return
+
+                    if path in self.paths:
+                        yield self.paths[path], json.loads(buffer[position:end])
+
+                    self._end_value(frame, end)
+            else:
+                raise ValueError(f'Unexpected {char!r} at offset {position} of the export')
+
+    def _scan(self, buffer: str, position: int) -> Tuple[int, bool]:
+        """
+        Walks the brackets of the current string/object/array. Returns the offset after its end, or the offset to resume
+        from with the next chunk, and whether it ended.
+        """
+        depth: int = self._depth
+        in_string: bool = self._in_string
+
+        while True:
+            if in_string:
+                position = STRING_END.match(buffer, position).end()
+
+                # the closing quote, or an escape sequence split between chunks, is in the next chunk
+                if position == len(buffer) or buffer[position] != '"':
+                    break
+
+                position += 1
+                in_string = False
+
+                if not depth:
+                    return position, True
+
+            position = NON_STRUCTURAL.match(buffer, position).end()
+
+            if position == len(buffer):
+                break
+
+            char: str = buffer[position]
+            position += 1
+
+            if char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+
+                if not depth:
+                    return position, True
+
+        self._depth, self._in_string = depth, in_string
+
+        return position, False
+
+    def _skip_chunk(self, buffer: str, position: int) -> Optional[int]:
+        """
+        Counts the brackets of the rest of the buffer without walking them. Returns the offset to resume from with the
+        next chunk, or `None` if the current string/object/array may end in the buffer.
+        """
+        depth: int = self._depth
+
+        if self._in_string:
+            position = STRING_END.match(buffer, position).end()
+
+            if position == len(buffer) or buffer[position] != '"':
+                return position
+            elif not depth:
+                return None
+
+            position += 1
+
+        # the strings are complete, but the last one which continues in the next chunk
+        rest: str = STRING.sub('', buffer[position:])
+        quote: int = rest.find('"')
+        resume: int = len(buffer) if quote == -1 else len(buffer) - len(rest) + quote + 1
+
+        # once the matching brackets are removed, the value ends in the buffer if enough of them are left unopened
+        brackets: str = NON_BRACKETS.sub('', rest if quote == -1 else rest[:quote])
+        unmatched: str = BRACKET_PAIRS.sub('', brackets)
+
+        while unmatched != brackets:
+            brackets, unmatched = unmatched, BRACKET_PAIRS.sub('', unmatched)
+
+        closing: int = len(unmatched) - len(unmatched.lstrip(']}'))
+
+        if closing >= depth:
+            return None
+
+        self._depth, self._in_string = depth + len(unmatched) - 2 * closing, quote != -1
+
+        return resume
+
+    def _end_value(self, frame: Optional[list], end: int):
+        if frame is not None:
+            frame[2] = 'next'
+
+        self._position = end
+        self._root_done = frame is None
+
+
+def transcribe(file_path: Union[str, Path],
+               api_key: str,
+               stream_configuration_template_id: str,
+               completion_listener: Optional[CompletionListener] = None) -> Future:
+    import requests
 
-def transcribe(file_path: Union[str, Path], api_key: str, stream_configuration_template_id: str):
     assert api_key, 'API_KEY is required'
 
     stream_id: str = str(uuid.uuid4())
 
+    # registered before the upload, so an early callback is not missed
+    if completion_listener is not None:
+        completion_listener.register(stream_id)
+
     # Upload the file
     upload_url: str = 'https://http-gateway.vatis.tech/http-gateway/api/v1/upload'
 
@@ -25,46 +291,40 @@ def transcribe(file_path: Union[str, Path], api_key: str, stream_configuration_t
         'enhancedTranscription': 'true',
     }
 
+    if completion_listener is not None:
+        query_parameters.update(completion_listener.webhook_parameters())
+
     upload_headers: dict = {
         'Accept': 'application/json',
         'Authorization': f'Basic {api_key}',
         'Content-Type': 'application/octet-stream'
     }
 
-    with open(file_path, 'rb') as payload:
-        upload_response = requests.post(upload_url, headers=upload_headers, params=query_parameters, data=payload)
+    upload_response = None
+
+    try:
+        with open(file_path, 'rb') as payload:
+            upload_response = requests.post(upload_url, headers=upload_headers, params=query_parameters, data=payload)
+    finally:
+        # no callback comes for a stream that was not created
+        if completion_listener is not None and (upload_response is None or not upload_response.ok):
+            completion_listener.unregister(stream_id)
 
     if not upload_response.ok:
         print(f'Error on file upload: {upload_response.status_code} - {upload_response.json()}')
-        return
-
-    print(f'File uploaded successfully: {stream_id}')
 
-    # wait on stream status
-    status_url = f'https://stream-service.vatis.tech/stream-service/api/v1/streams/{stream_id}'
+        result: Future = Future()
+        result.set_result(None)
+        return result
 
-    status_headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Basic {api_key}',
-    }
+    print(f'File uploaded successfully: {stream_id}')
 
-    while True:
-        status_response = requests.request('GET', status_url, headers=status_headers)
+    # wait on stream completion in the background, the webhook resolves it as soon as the stream is done
+    return complete_in_background(stream_id, api_key, completion_listener, export)
 
-        if not status_response.ok:
-            print(f'Error on stream status: {status_response.json()}')
-            return
 
-        if status_response.json()['state'] == 'COMPLETED':
-            break
-        elif status_response.json()['state'] == 'FAILED':
-            print(f'Error on stream: {status_response.json()}')
-            break
-        else:
-            sleep(3)
-            print(f'Waiting for stream to be completed: {stream_id}')
-
-    print(f'The stream is completed: {stream_id}')
+def export(stream_id: str, api_key: str, sections: Tuple[str, ...] = EXPORT_SECTIONS) -> Optional[dict]:
+    import requests
 
     # Export the results
     export_url: str = f"https://export-service.vatis.tech/export-service/api/v1/export/JSON?streams={stream_id}"
@@ -74,13 +334,44 @@ def transcribe(file_path: Union[str, Path], api_key: str, stream_configuration_t
         'Accept': 'application/json'
     }
 
-    export_response = requests.request('GET', export_url, headers=export_headers)
-    export_result = export_response.json()
+    with requests.request('GET', export_url, headers=export_headers, stream=True) as export_response:
+        if not export_response.ok or not sections:
+            export_result = export_response.json()
 
-    if export_response.ok:
-        print(export_result['enhancedTranscription']['transcription']['text'])
-    else:
-        print(f'Error on export: {export_result}')
+            if not export_response.ok:
+                print(f'Error on export: {export_result}')
+                return None
+
+            return export_result
+
+        export_result = dict(iter_export_sections(export_response, sections))
+
+    missing_sections: List[str] = [section for section in sections if section not in export_result]
+
+    if missing_sections:
+        print(f'Sections missing from the export: {", ".join(missing_sections)}')
+
+    return export_result
+
+
+def iter_export_sections(export_response, sections: Tuple[str, ...]) -> Iterator[Tuple[str, object]]:
+    """
+    Yields the requested sections while the export is downloaded, and stops the download once all of them are parsed.
+    """
+    parser: SectionStreamParser = SectionStreamParser({name: SECTION_PATHS[name] for name in sections})
+    pending: set = set(sections)
+
+    export_response.encoding = export_response.encoding or 'utf-8'
+
+    chunks: Iterator[str] = export_response.iter_content(chunk_size=EXPORT_CHUNK_SIZE, decode_unicode=True)
+
+    # the end of the export is parsed even if an incomplete value was waiting for more data
+    for name, value in chain(chain.from_iterable(map(parser.feed, chunks)), parser.close()):
+        pending.discard(name)
+        yield name, value
+
+        if not pending:
+            return
 
 
 if __name__ == '__main__':
@@ -93,9 +384,32 @@ if __name__ == '__main__':
 
     assert file_path.exists() and file_path.is_file(), f'File {file_path} does not exist or is not a file'
 
+    unknown_sections: List[str] = [section for section in EXPORT_SECTIONS if section not in SECTION_PATHS]
+
+    assert not unknown_sections, f'Unknown EXPORT_SECTIONS {", ".join(unknown_sections)}, available: {", ".join(SECTION_PATHS)}'
+
     api_key: str = os.environ.get('API_KEY')
     stream_configuration_template_id: str = os.environ.get('CONFIGURATION_ID', '668115d123bca7e3509723d4')
 
-    transcribe(file_path=file_path,
-               api_key=api_key,
-               stream_configuration_template_id=stream_configuration_template_id)
+    completion_listener: Optional[CompletionListener] = None
+
+    if WEBHOOK_BASE_URL:
+        completion_listener = CompletionListener(WEBHOOK_BASE_URL, WEBHOOK_PORT)
+        completion_listener.start()
+
+    try:
+        export_result: Optional[dict] = transcribe(file_path=file_path,
+                                                   api_key=api_key,
+                                                   stream_configuration_template_id=stream_configuration_template_id,
+                                                   completion_listener=completion_listener).result()
+    finally:
+        if completion_listener is not None:
+            completion_listener.close()
+
+    if export_result is None:
+        pass
+    elif not EXPORT_SECTIONS:
+        print(export_result['enhancedTranscription']['transcription']['text'])
+    else:
+        for section, value in export_result.items():
+            print(value if isinstance(value, str) else json.dumps(value, indent=2))
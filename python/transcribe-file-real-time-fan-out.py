@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    import websocket
+
+# configuration #####
+BASE_URL: str = 'wss://ws-gateway.vatis.tech'
+CHUNK_SIZE: int = 1024
+# configuration end #####
+
+EOS = '{"type": "END_OF_STREAM"}'
+
+
+class FanOutStream:
+    """
+    One configuration of the fan-out: streams the shared audio chunks and collects the final transcript and the timings.
+    """
+
+    def __init__(self, stream_configuration_template_id: str, language: str):
+        self.stream_configuration_template_id: str = stream_configuration_template_id
+        self.language: str = language
+        self.stream_id: str = str(uuid.uuid4())
+
+        self.final_transcript: str = ''
+        self.errors: List[str] = []
+        self.closed_event: threading.Event = threading.Event()
+
+        self.started_at: Optional[float] = None
+        self.opened_at: Optional[float] = None
+        self.first_response_at: Optional[float] = None
+        self.sent_at: Optional[float] = None
+        self.closed_at: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return f'{self.stream_configuration_template_id}/{self.language}'
+
+    def run(self, chunks: List[memoryview], api_key: str):
+        import websocket
+
+        # configuration options here
+        parameters = {
+            'id': self.stream_id,
+            'streamConfigurationTemplateId': self.stream_configuration_template_id,
+            'language': self.language,
+        }
+
+        # authentication headers
+        headers = {
+            'Authorization': f'Basic {api_key}',
+        }
+
+        # define the connection and its callbacks
+        connection: websocket.WebSocketApp = websocket.WebSocketApp(
+            f'{BASE_URL}/ws-gateway/api/v1/?{"&".join([f"{k}={v}" for k, v in parameters.items()])}',
+            header=headers,
+            on_open=lambda ws: self.on_open(ws, chunks),
+            on_message=self.on_message,
+            on_error=lambda ws, error: self.errors.append(str(error)),
+            on_close=lambda ws, _, __: self.closed_event.set(),
+        )
+
+        self.started_at = time.perf_counter()
+        connection.run_forever(ping_interval=5)
+        self.closed_at = time.perf_counter()
+
+    def on_open(self, ws: 'websocket.WebSocketApp', chunks: List[memoryview]):
+        self.opened_at = time.perf_counter()
+
+        def _send_data():
+            try:
+                for chunk in chunks:
+                    if self.closed_event.is_set():
+                        break
+                    ws.send_bytes(chunk)
+
+                if not self.closed_event.is_set():
+                    ws.send_text(EOS)
+                    self.sent_at = time.perf_counter()
+            except Exception as e:
+                # reported with this configuration, the others keep streaming
+                if not self.closed_event.is_set():
+                    self.errors.append(f'Error sending data: {e}')
+                    ws.close()
+
+        threading.Thread(target=_send_data, name=f'data-sender-{self.name}', daemon=True).start()
+
+    def on_message(self, ws: 'websocket.WebSocketApp', event_json: str):
+        if not event_json:
+            return
+
+        event: dict = json.loads(event_json)
+
+        if event['type'] == 'RESPONSE':
+            if self.first_response_at is None:
+                self.first_response_at = time.perf_counter()
+
+            response: dict = event['response']
+
+            if response.get('frameType') == 'final':
+                self.final_transcript += response['payload']['transcription']
+        elif event['type'] == 'ERROR':
+            self.errors.append(str(event['error']))
+        elif event['type'] == 'END_OF_STREAM':
+            ws.close()
+
+    def report(self) -> dict:
+        def _elapsed_ms(moment: Optional[float]) -> Optional[float]:
+            return round((moment - self.started_at) * 1000, 1) if moment is not None and self.started_at is not None else None
+
+        return {
+            'configuration': self.name,
+            'streamId': self.stream_id,
+            'connectMs': _elapsed_ms(self.opened_at),
+            'firstResponseMs': _elapsed_ms(self.first_response_at),
+            'sentMs': _elapsed_ms(self.sent_at),
+            'totalMs': _elapsed_ms(self.closed_at),
+            'errors': self.errors,
+            'transcript': self.final_transcript,
+        }
+
+
+def load_chunks(file_path: Path, chunk_size: int = CHUNK_SIZE) -> List[memoryview]:
+    # the file is read once, every stream sends zero-copy slices of the same buffer
+    audio: memoryview = memoryview(file_path.read_bytes())
+
+    return [audio[offset:offset + chunk_size] for offset in range(0, len(audio), chunk_size)]
+
+
+def transcribe(file_path: Path, api_key: str, configurations: List[FanOutStream]) -> List[dict]:
+    assert api_key, 'API_KEY is required'
+    assert configurations, 'At least one configuration is required'
+
+    chunks: List[memoryview] = load_chunks(file_path)
+
+    threads: List[threading.Thread] = [
+        threading.Thread(target=stream.run, args=(chunks, api_key), name=f'stream-{stream.name}', daemon=True)
+        for stream in configurations
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return [stream.report() for stream in configurations]
+
+
+def print_comparison(reports: List[dict]):
+    width: int = max(len(report['configuration']) for report in reports)
+
+    print(f'{"configuration":<{width}}  {"connect":>9}  {"first resp.":>11}  {"sent":>9}  {"total":>9}')
+
+    for report in reports:
+        columns = [f'{report[key]:.1f}' if report[key] is not None else '-'
+                   for key in ('connectMs', 'firstResponseMs', 'sentMs', 'totalMs')]
+        print(f'{report["configuration"]:<{width}}  {columns[0]:>9}  {columns[1]:>11}  {columns[2]:>9}  {columns[3]:>9}')
+
+    for report in reports:
+        print(f'\n{report["configuration"]} (stream id: {report["streamId"]})')
+
+        for error in report['errors']:
+            print(f'Error: {error}')
+
+        print(report['transcript'])
+
+
+if __name__ == '__main__':
+    default_configuration_id: str = os.environ.get('CONFIGURATION_ID', '670ba9e0efa59fe6aecd56f1')
+
+    parser = ArgumentParser(description='Transcribe an audio file in real-time with multiple configurations, reading the file once')
+    parser.add_argument('--file-path', type=str, default=os.environ.get('FILE_PATH', '../data/stt/test-phone-call.wav'), help='Path to the audio file to transcribe')
+    parser.add_argument('--config', '-c', type=str, action='append', default=None,
+                        help='Configuration in the form of "<stream template id>:<language>", can be repeated')
+    parser.add_argument('--output', '-o', type=str, default=None, help='Write the comparison as JSON to this file')
+    args = parser.parse_args()
+
+    file_path = Path(args.file_path).resolve()
+
+    assert file_path.exists() and file_path.is_file(), f'File {file_path} does not exist or is not a file'
+
+    api_key: str = os.environ.get('API_KEY')
+
+    streams: List[FanOutStream] = []
+
+    for config in args.config or [f'{default_configuration_id}:en']:
+        template_id, _, language = config.partition(':')
+        streams.append(FanOutStream(template_id or default_configuration_id, language or 'en'))
+
+    comparison: List[dict] = transcribe(file_path=file_path, api_key=api_key, configurations=streams)
+
+    print_comparison(comparison)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(comparison, indent=2))
@@ -0,0 +1,324 @@
+import json
+import multiprocessing
+import os
+import statistics
+import struct
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import websocket
+
+# configuration #####
+BASE_URL: str = 'wss://ws-gateway.vatis.tech'
+CHUNK_SIZE: int = 1024
+# configuration end #####
+
+EOS = '{"type": "END_OF_STREAM"}'
+
+# record sent from the workers to the supervisor: kind, stream index, connect ms, first response ms, total ms, payload size
+# followed by the utf-8 payload (the transcript, the error or the worker metrics)
+RECORD = struct.Struct('<BIfffI')
+RECORD_RESULT: int = 1
+RECORD_ERROR: int = 2
+RECORD_WORKER_DONE: int = 3
+
+
+class WorkerChannel:
+    """
+    Worker side of the pipe to the supervisor, shared by all the streams of the worker.
+    """
+
+    def __init__(self, connection: Connection):
+        self.connection: Connection = connection
+        self._lock: threading.Lock = threading.Lock()
+
+    def send(self, kind: int, index: int, payload: str, connect_ms: float = -1, first_response_ms: float = -1, total_ms: float = -1):
+        data: bytes = payload.encode('utf-8')
+
+        with self._lock:
+            self.connection.send_bytes(RECORD.pack(kind, index, connect_ms, first_response_ms, total_ms, len(data)) + data)
+
+
+def run_stream(index: int,
+               chunks: List[memoryview],
+               api_key: str,
+               stream_configuration_template_id: str,
+               channel: WorkerChannel) -> int:
+    import websocket
+
+    stream_id: str = str(uuid.uuid4())
+    closed_event: threading.Event = threading.Event()
+    final_transcript: List[str] = []
+    errors: List[str] = []
+    timings: Dict[str, float] = {}
+    frames: List[int] = [0]
+
+    # configuration options here
+    parameters = {
+        'id': stream_id,
+        'streamConfigurationTemplateId': stream_configuration_template_id,
+        'language': 'en',  # set the language here
+    }
+
+    # authentication headers
+    headers = {
+        'Authorization': f'Basic {api_key}',
+    }
+
+    def _on_open(ws: 'websocket.WebSocketApp'):
+        timings['connect'] = time.perf_counter()
+
+        def _send_data():
+            try:
+                for chunk in chunks:
+                    if closed_event.is_set():
+                        break
+                    ws.send_bytes(chunk)
+
+                if not closed_event.is_set():
+                    ws.send_text(EOS)
+            except Exception as e:
+                # reported as the error of this stream, the others keep streaming
+                if not closed_event.is_set():
+                    errors.append(f'Error sending data: {e}')
+                    ws.close()
+
+        threading.Thread(target=_send_data, name=f'data-sender-{index}', daemon=True).start()
+
+    def _on_message(ws: 'websocket.WebSocketApp', event_json: str):
+        if not event_json:
+            return
+
+        event: dict = json.loads(event_json)
+
+        if event['type'] == 'RESPONSE':
+            frames[0] += 1
+            timings.setdefault('first_response', time.perf_counter())
+
+            if event['response'].get('frameType') == 'final':
+                final_transcript.append(event['response']['payload']['transcription'])
+        elif event['type'] == 'ERROR':
+            errors.append(str(event['error']))
+        elif event['type'] == 'END_OF_STREAM':
+            ws.close()
+
+    # define the connection and its callbacks
+    connection: websocket.WebSocketApp = websocket.WebSocketApp(
+        f'{BASE_URL}/ws-gateway/api/v1/?{"&".join([f"{k}={v}" for k, v in parameters.items()])}',
+        header=headers,
+        on_open=_on_open,
+        on_message=_on_message,
+        on_error=lambda ws, error: errors.append(str(error)),
+        on_close=lambda ws, _, __: closed_event.set(),
+    )
+
+    started: float = time.perf_counter()
+    connection.run_forever(ping_interval=5)
+    finished: float = time.perf_counter()
+
+    def _elapsed_ms(name: str) -> float:
+        return (timings[name] - started) * 1000 if name in timings else -1
+
+    if errors:
+        channel.send(RECORD_ERROR, index, '; '.join(errors), _elapsed_ms('connect'), _elapsed_ms('first_response'), (finished - started) * 1000)
+    else:
+        channel.send(RECORD_RESULT, index, ''.join(final_transcript), _elapsed_ms('connect'), _elapsed_ms('first_response'), (finished - started) * 1000)
+
+    return frames[0]
+
+
+def worker_main(worker_id: int,
+                jobs: List[Tuple[int, str]],
+                streams_per_worker: int,
+                api_key: str,
+                stream_configuration_template_id: str,
+                connection: Connection):
+    channel: WorkerChannel = WorkerChannel(connection)
+    started: float = time.perf_counter()
+
+    # each distinct file is read once per worker, the streams send slices of the same buffer
+    buffers: Dict[str, List[memoryview]] = {}
+    read_errors: Dict[str, str] = {}
+
+    for _, file_path in jobs:
+        if file_path in buffers or file_path in read_errors:
+            continue
+
+        try:
+            audio: memoryview = memoryview(Path(file_path).read_bytes())
+        except OSError as e:
+            read_errors[file_path] = f'Error reading {file_path}: {e}'
+            continue
+
+        buffers[file_path] = [audio[offset:offset + CHUNK_SIZE] for offset in range(0, len(audio), CHUNK_SIZE)]
+
+    # the streams of an unreadable file fail, the others still run
+    for index, file_path in jobs:
+        if file_path in read_errors:
+            channel.send(RECORD_ERROR, index, read_errors[file_path])
+
+    frames: int = 0
+
+    with ThreadPoolExecutor(max_workers=streams_per_worker, thread_name_prefix=f'worker-{worker_id}') as executor:
+        futures = {executor.submit(run_stream, index, buffers[file_path], api_key, stream_configuration_template_id, channel): index
+                   for index, file_path in jobs if file_path in buffers}
+
+        for future, index in futures.items():
+            try:
+                frames += future.result()
+            except Exception as e:
+                channel.send(RECORD_ERROR, index, str(e))
+
+    metrics: dict = {'worker': worker_id, 'pid': os.getpid(), 'streams': len(jobs), 'frames': frames,
+                     'elapsedMs': round((time.perf_counter() - started) * 1000, 1)}
+    channel.send(RECORD_WORKER_DONE, worker_id, json.dumps(metrics))
+    connection.close()
+
+
+def supervise(file_paths: List[Path],
+              streams: int,
+              workers: int,
+              streams_per_worker: int,
+              api_key: str,
+              stream_configuration_template_id: str) -> Tuple[List[dict], List[dict]]:
+    assert api_key, 'API_KEY is required'
+
+    # round-robin the streams over the files, and the streams over the workers
+    jobs: List[Tuple[int, str]] = [(index, str(file_paths[index % len(file_paths)])) for index in range(streams)]
+    shards: List[List[Tuple[int, str]]] = [jobs[worker_id::workers] for worker_id in range(workers)]
+
+    processes: Dict[int, multiprocessing.Process] = {}
+    readers: List[Connection] = []
+
+    for worker_id, shard in enumerate(shards):
+        if not shard:
+            continue
+
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=worker_main,
+                                          args=(worker_id, shard, streams_per_worker, api_key, stream_configuration_template_id, writer),
+                                          name=f'worker-{worker_id}',
+                                          daemon=True)
+        process.start()
+        writer.close()
+
+        processes[worker_id] = process
+        readers.append(reader)
+
+    results: List[dict] = []
+    worker_metrics: Dict[int, dict] = {}
+
+    while readers:
+        for reader in wait(readers):
+            try:
+                data: bytes = reader.recv_bytes()
+            except EOFError:
+                readers.remove(reader)
+                continue
+
+            kind, index, connect_ms, first_response_ms, total_ms, size = RECORD.unpack_from(data)
+            payload: str = data[RECORD.size:RECORD.size + size].decode('utf-8')
+
+            if kind == RECORD_WORKER_DONE:
+                worker_metrics[index] = json.loads(payload)
+                continue
+
+            results.append({
+                'index': index,
+                'file': jobs[index][1],
+                'connectMs': round(connect_ms, 1) if connect_ms >= 0 else None,
+                'firstResponseMs': round(first_response_ms, 1) if first_response_ms >= 0 else None,
+                'totalMs': round(total_ms, 1) if total_ms >= 0 else None,
+                'error' if kind == RECORD_ERROR else 'transcript': payload,
+            })
+
+    received: set = {result['index'] for result in results}
+
+    for worker_id, process in processes.items():
+        process.join()
+
+        # a worker that crashed (or failed before running its streams) leaves them without a result
+        for index, file_path in shards[worker_id]:
+            if index not in received:
+                results.append({
+                    'index': index,
+                    'file': file_path,
+                    'connectMs': None,
+                    'firstResponseMs': None,
+                    'totalMs': None,
+                    'error': f'No result from worker {worker_id} (pid {process.pid}, exit code {process.exitcode})',
+                })
+
+        metrics: dict = worker_metrics.setdefault(worker_id, {'worker': worker_id, 'pid': process.pid, 'streams': len(shards[worker_id]),
+                                                              'frames': None, 'elapsedMs': None})
+        metrics['exitCode'] = process.exitcode
+
+    return sorted(results, key=lambda result: result['index']), list(worker_metrics.values())
+
+
+def print_summary(results: List[dict], worker_metrics: List[dict], elapsed_seconds: float):
+    succeeded: List[dict] = [result for result in results if 'error' not in result]
+
+    print(f'Streams: {len(results)}, succeeded: {len(succeeded)}, failed: {len(results) - len(succeeded)}, '
+          f'elapsed: {elapsed_seconds:.1f} s, throughput: {len(results) / elapsed_seconds:.2f} streams/s')
+
+    for key in ('connectMs', 'firstResponseMs', 'totalMs'):
+        values: List[float] = sorted(result[key] for result in succeeded if result[key] is not None)
+
+        if values:
+            p95: float = values[min(len(values) - 1, int(len(values) * 0.95))]
+            print(f'{key:<16} p50: {statistics.median(values):>9.1f}  p95: {p95:>9.1f}  max: {values[-1]:>9.1f}')
+
+    for metrics in sorted(worker_metrics, key=lambda item: item['worker']):
+        if metrics['elapsedMs'] is None:
+            print(f'Worker {metrics["worker"]} (pid {metrics["pid"]}): {metrics["streams"]} streams, '
+                  f'exited with code {metrics["exitCode"]} before reporting')
+        else:
+            exit_status: str = f', exit code {metrics["exitCode"]}' if metrics['exitCode'] else ''
+            print(f'Worker {metrics["worker"]} (pid {metrics["pid"]}): {metrics["streams"]} streams, '
+                  f'{metrics["frames"]} frames, {metrics["elapsedMs"] / 1000:.1f} s{exit_status}')
+
+    for result in results:
+        if 'error' in result:
+            print(f'Error on stream {result["index"]}: {result["error"]}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Transcribe audio files in real-time using multiple worker processes, each running many streams')
+    parser.add_argument('files', type=str, nargs='*', default=[os.environ.get('FILE_PATH', '../data/stt/test-phone-call.wav')], help='Audio files to transcribe')
+    parser.add_argument('--streams', '-n', type=int, default=None, help='Total number of streams, cycling over the files (defaults to one per file)')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--streams-per-worker', '-s', type=int, default=16, help='Number of concurrent streams in each worker')
+    parser.add_argument('--output', '-o', type=str, default=None, help='JSON lines file with the result of each stream')
+    args = parser.parse_args()
+
+    files: List[Path] = [Path(file).resolve() for file in args.files]
+
+    for file in files:
+        assert file.exists() and file.is_file(), f'File {file} does not exist or is not a file'
+
+    api_key: Optional[str] = os.environ.get('API_KEY')
+    stream_configuration_template_id: str = os.environ.get('CONFIGURATION_ID', '670ba9e0efa59fe6aecd56f1')
+
+    started_at: float = time.perf_counter()
+
+    stream_results, workers_metrics = supervise(file_paths=files,
+                                                streams=args.streams or len(files),
+                                                workers=args.workers,
+                                                streams_per_worker=args.streams_per_worker,
+                                                api_key=api_key,
+                                                stream_configuration_template_id=stream_configuration_template_id)
+
+    print_summary(stream_results, workers_metrics, time.perf_counter() - started_at)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            for stream_result in stream_results:
+                output.write(json.dumps(stream_result) + '\n')
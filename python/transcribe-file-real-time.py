@@ -4,9 +4,12 @@ import sys
 import threading
 import uuid
 from pathlib import Path
-from typing import Generator
+from typing import TYPE_CHECKING, Generator, Optional
 
-import websocket
+from transcript_deltas import StablePrefixTracker, TranscriptDelta
+
+if TYPE_CHECKING:
+    import websocket
 
 # configuration #####
 BASE_URL: str = 'wss://ws-gateway.vatis.tech'
@@ -16,9 +19,12 @@ DISPLAY_PARTIAL_FRAMES: bool = False
 EOS = '{"type": "END_OF_STREAM"}'
 closed_event: threading.Event = threading.Event()
 final_transcript: str = ''
+partial_frames: StablePrefixTracker = StablePrefixTracker()
 
 
 def transcribe(stream_generator: Generator[bytes, None, None], api_key: str, stream_configuration_template_id: str):
+    import websocket
+
     assert api_key, 'API_KEY is required'
 
     stream_id: str = str(uuid.uuid4())
@@ -50,7 +56,7 @@ def transcribe(stream_generator: Generator[bytes, None, None], api_key: str, str
     print(f'\nTranscription:\n\n{final_transcript}')
 
 
-def on_open(ws: websocket.WebSocketApp, stream_generator: Generator[bytes, None, None]):
+def on_open(ws: 'websocket.WebSocketApp', stream_generator: Generator[bytes, None, None]):
     def _send_data():
         for data in stream_generator:
             if closed_event.is_set():
@@ -63,7 +69,7 @@ def on_open(ws: websocket.WebSocketApp, stream_generator: Generator[bytes, None,
     threading.Thread(target=_send_data, name='data-sender', daemon=True).start()
 
 
-def on_message(ws: websocket.WebSocket, event_json: str):
+def on_message(ws: 'websocket.WebSocket', event_json: str):
     if not event_json:
         return
 
@@ -89,19 +95,23 @@ def print_transcription(event: dict, display_all: bool = False):
 
     assert event['payloadSchema'] == 'tech.vatis.schema.stream.processor.messages.transcription.TranscriptionResponseDto', f'Not a transcription event: {event}'
 
-    # filter out partial frames, display only the final results
-    if event['frameType'] == 'final' or display_all:
-        transcript: str = event['payload']['transcription']
-        start_time: int = event['payload']['start'] / 1000
-        end_time: int = event['payload']['end'] / 1000
-        frame_type: str = event['frameType']
+    delta: Optional[TranscriptDelta] = partial_frames.update(event)
+
+    # the partial frame repeats the previous hypothesis
+    if delta is None:
+        return
+
+    if delta.frame_type == 'final':
+        final_transcript += delta.transcript
 
-        if frame_type == 'final':
-            final_transcript += transcript
+    formatted_start: str = f'{delta.start / 1000:.2f}'
+    formatted_end: str = f'{delta.end / 1000:.2f}'
 
-        formatted_start: str = f'{start_time:.2f}'
-        formatted_end: str = f'{end_time:.2f}'
-        print(f'{formatted_start:>6} - {formatted_end:<6} - {frame_type:<7}: {transcript}')
+    # with partial frames, display only the changed tail of the hypothesis
+    if display_all:
+        print(f'{formatted_start:>6} - {formatted_end:<6} - {delta.action:<7} @{delta.offset:<4}: {delta.text}')
+    elif delta.frame_type == 'final':
+        print(f'{formatted_start:>6} - {formatted_end:<6} - {delta.frame_type:<7}: {delta.transcript}')
 
 
 def stream_file(file_path: Path, chunk_size: int = 1024) -> Generator[bytes, None, None]:
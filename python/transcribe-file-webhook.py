@@ -8,13 +8,13 @@ from typing import Union
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
-import requests
-
 
 def transcribe(file_path: Union[str, Path],
                api_key: str,
                stream_configuration_template_id: str,
                webhook_base_url: str):
+    import requests
+
     assert api_key, 'API_KEY is required'
 
     stream_id: str = str(uuid.uuid4())
@@ -47,6 +47,8 @@ def transcribe(file_path: Union[str, Path],
 
 
 def do_on_stream_completed(stream_id: str, api_key: str):
+    import requests
+
     # Export the results
     export_url: str = f"https://export-service.vatis.tech/export-service/api/v1/export/JSON?streams={stream_id}"
 
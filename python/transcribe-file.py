@@ -1,19 +1,34 @@
 import json
 import uuid
-from time import sleep
-from typing import Union
+from concurrent.futures import Future
+from typing import Optional, Union
 
-import requests
 import os
 import sys
 from pathlib import Path
 
+from stream_completion import CompletionListener, complete_in_background
+
+# configuration #####
+WEBHOOK_BASE_URL: Optional[str] = os.environ.get('WEBHOOK_BASE_URL')  # public URL of the completion listener, polling is used if missing
+WEBHOOK_PORT: int = int(os.environ.get('WEBHOOK_PORT', '8081'))
+# configuration end #####
+
+
+def transcribe(file_path: Union[str, Path],
+               api_key: str,
+               stream_configuration_template_id: str,
+               completion_listener: Optional[CompletionListener] = None) -> Future:
+    import requests
 
-def transcribe(file_path: Union[str, Path], api_key: str, stream_configuration_template_id: str):
     assert api_key, 'API_KEY is required'
 
     stream_id: str = str(uuid.uuid4())
 
+    # registered before the upload, so an early callback is not missed
+    if completion_listener is not None:
+        completion_listener.register(stream_id)
+
     # Upload the file
     upload_url: str = 'https://http-gateway.vatis.tech/http-gateway/api/v1/upload'
 
@@ -23,62 +38,36 @@ def transcribe(file_path: Union[str, Path], api_key: str, stream_configuration_t
         'persist': 'true'
     }
 
+    if completion_listener is not None:
+        query_parameters.update(completion_listener.webhook_parameters())
+
     upload_headers: dict = {
         'Accept': 'application/json',
         'Authorization': f'Basic {api_key}',
         'Content-Type': 'application/octet-stream'
     }
 
-    with open(file_path, 'rb') as payload:
-        upload_response = requests.post(upload_url, headers=upload_headers, params=query_parameters, data=payload)
+    upload_response = None
+
+    try:
+        with open(file_path, 'rb') as payload:
+            upload_response = requests.post(upload_url, headers=upload_headers, params=query_parameters, data=payload)
+    finally:
+        # no callback comes for a stream that was not created
+        if completion_listener is not None and (upload_response is None or not upload_response.ok):
+            completion_listener.unregister(stream_id)
 
     if not upload_response.ok:
         print(f'Error on file upload: {upload_response.status_code} - {upload_response.json()}')
-        return
-
-    print(f'File uploaded successfully: {stream_id}')
-
-    # wait on stream status
-    status_url = f'https://stream-service.vatis.tech/stream-service/api/v1/streams/{stream_id}'
-
-    status_headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Basic {api_key}',
-    }
-
-    while True:
-        status_response = requests.request('GET', status_url, headers=status_headers)
 
-        if not status_response.ok:
-            print(f'Error on stream status: {status_response.json()}')
-            return
+        result: Future = Future()
+        result.set_result(None)
+        return result
 
-        if status_response.json()['state'] == 'COMPLETED':
-            break
-        elif status_response.json()['state'] == 'FAILED':
-            print(f'Error on stream: {status_response.json()}')
-            break
-        else:
-            sleep(3)
-            print(f'Waiting for stream to be completed: {stream_id}')
-
-    print(f'The stream is completed: {stream_id}')
+    print(f'File uploaded successfully: {stream_id}')
 
-    # Export the results
-    export_url: str = f"https://export-service.vatis.tech/export-service/api/v1/export/JSON?streams={stream_id}"
-
-    export_headers: dict = {
-        'Authorization': f'Basic {api_key}',
-        'Accept': 'application/json'
-    }
-
-    export_response = requests.request('GET', export_url, headers=export_headers)
-    export_result = export_response.json()
-
-    if export_response.ok:
-        print(json.dumps(export_result, indent=2))
-    else:
-        print(f'Error on export: {export_result}')
+    # wait on stream completion in the background, the webhook resolves it as soon as the stream is done
+    return complete_in_background(stream_id, api_key, completion_listener)
 
 
 if __name__ == '__main__':
@@ -94,6 +83,20 @@ if __name__ == '__main__':
     api_key: str = os.environ.get('API_KEY')
     stream_configuration_template_id: str = os.environ.get('CONFIGURATION_ID', '668115d123bca7e3509723d4')
 
-    transcribe(file_path=file_path,
-               api_key=api_key,
-               stream_configuration_template_id=stream_configuration_template_id)
+    completion_listener: Optional[CompletionListener] = None
+
+    if WEBHOOK_BASE_URL:
+        completion_listener = CompletionListener(WEBHOOK_BASE_URL, WEBHOOK_PORT)
+        completion_listener.start()
+
+    try:
+        export_result: Optional[dict] = transcribe(file_path=file_path,
+                                                   api_key=api_key,
+                                                   stream_configuration_template_id=stream_configuration_template_id,
+                                                   completion_listener=completion_listener).result()
+    finally:
+        if completion_listener is not None:
+            completion_listener.close()
+
+    if export_result is not None:
+        print(json.dumps(export_result, indent=2))
@@ -0,0 +1,264 @@
+import json
+import os
+import sys
+import threading
+import uuid
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+if TYPE_CHECKING:
+    import requests
+
+# configuration #####
+DEFAULT_PORTS: Dict[str, int] = {'http': 80, 'https': 443}
+IGNORED_QUERY_PARAMETERS: Tuple[str, ...] = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'fbclid', 'gclid')
+STATUS_TIMEOUT_SECONDS: float = 2 * 60 * 60  # a stream not completed in this time is reported as failed
+# configuration end #####
+
+thread_local: threading.local = threading.local()
+
+
+def get_session() -> 'requests.Session':
+    import requests
+
+    # one session per worker thread, so the connections to the gateways are reused between the links
+    if not hasattr(thread_local, 'session'):
+        thread_local.session = requests.Session()
+
+    return thread_local.session
+
+
+def normalize_link(file_link: str) -> str:
+    """
+    Canonical form of a link, used only to detect duplicates: the original link is the one submitted.
+    Raises `ValueError` for malformed links (e.g. an invalid port).
+    """
+    parts = urlsplit(file_link.strip())
+
+    scheme: str = parts.scheme.lower()
+    hostname: str = (parts.hostname or '').lower()
+    port: Optional[int] = parts.port
+
+    # IPv6 addresses keep their brackets
+    netloc: str = f'[{hostname}]' if ':' in hostname else hostname
+
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{port}'
+
+    if parts.username:
+        netloc = f'{parts.username}:{parts.password}@{netloc}' if parts.password else f'{parts.username}@{netloc}'
+
+    # drop the tracking parameters and sort the others by name, they don't change the media. The parameters are
+    # kept as written (no decoding), and repeated ones keep their relative order
+    query: List[str] = sorted((parameter for parameter in parts.query.split('&')
+                               if parameter and parameter.split('=', 1)[0].lower() not in IGNORED_QUERY_PARAMETERS),
+                              key=lambda parameter: parameter.split('=', 1)[0])
+
+    # the fragment is never sent to the server
+    return urlunsplit((scheme, netloc, parts.path or '/', '&'.join(query), ''))
+
+
+def media_key(file_link: str, normalized_link: str, timeout: float) -> str:
+    """
+    Identifies the media behind a link using a HEAD request, so different links to the same media are transcribed once.
+    Falls back to the normalized link when the server does not expose the ETag.
+    """
+    try:
+        response = get_session().head(file_link, allow_redirects=True, timeout=timeout)
+    except Exception as e:
+        print(f'Error on HEAD {file_link}: {e}', file=sys.stderr)
+        return normalized_link
+
+    etag: Optional[str] = response.headers.get('ETag')
+
+    if not response.ok:
+        return normalized_link
+
+    if not etag:
+        try:
+            return normalize_link(response.url)
+        except ValueError:
+            return normalized_link
+
+    content_length: str = response.headers.get('Content-Length', '')
+
+    return f'{urlsplit(response.url).hostname}|{etag}|{content_length}'
+
+
+def transcribe(file_link: str, api_key: str, stream_configuration_template_id: str) -> dict:
+    session = get_session()
+
+    stream_id: str = str(uuid.uuid4())
+
+    # Upload the file
+    upload_url: str = 'https://http-gateway.vatis.tech/http-gateway/api/v1/upload'
+
+    query_parameters: dict = {
+        'streamConfigurationTemplateId': stream_configuration_template_id,
+        'id': stream_id,
+        'persist': 'true'
+    }
+
+    upload_headers: dict = {
+        'Accept': 'application/json',
+        'Authorization': f'Basic {api_key}',
+        'Content-Type': 'application/octet-stream'
+    }
+
+    upload_response = session.post(upload_url,
+                                   headers=upload_headers,
+                                   params=query_parameters,
+                                   data=file_link.encode('utf-8'))
+
+    if not upload_response.ok:
+        return {'streamId': stream_id, 'state': 'FAILED', 'error': f'Error on file upload: {upload_response.status_code} - {upload_response.text}'}
+
+    print(f'File uploaded successfully: {stream_id} - {file_link}', file=sys.stderr)
+
+    # wait on stream status
+    status_url = f'https://stream-service.vatis.tech/stream-service/api/v1/streams/{stream_id}'
+
+    status_headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Basic {api_key}',
+    }
+
+    deadline: float = monotonic() + STATUS_TIMEOUT_SECONDS
+
+    while True:
+        status_response = session.request('GET', status_url, headers=status_headers)
+
+        if not status_response.ok:
+            return {'streamId': stream_id, 'state': 'FAILED', 'error': f'Error on stream status: {status_response.text}'}
+
+        if status_response.json()['state'] == 'COMPLETED':
+            break
+        elif status_response.json()['state'] == 'FAILED':
+            return {'streamId': stream_id, 'state': 'FAILED', 'error': f'Error on stream: {status_response.json()}'}
+        elif monotonic() > deadline:
+            return {'streamId': stream_id, 'state': 'FAILED', 'error': f'The stream is not completed after {STATUS_TIMEOUT_SECONDS} seconds'}
+        else:
+            sleep(3)
+
+    print(f'The stream is completed: {stream_id}', file=sys.stderr)
+
+    # Export the results
+    export_url: str = f"https://export-service.vatis.tech/export-service/api/v1/export/JSON?streams={stream_id}"
+
+    export_headers: dict = {
+        'Authorization': f'Basic {api_key}',
+        'Accept': 'application/json'
+    }
+
+    export_response = session.request('GET', export_url, headers=export_headers)
+
+    if not export_response.ok:
+        return {'streamId': stream_id, 'state': 'FAILED', 'error': f'Error on export: {export_response.text}'}
+
+    return {'streamId': stream_id, 'state': 'COMPLETED', 'export': export_response.json()}
+
+
+def transcribe_batch(file_links: Iterable[str],
+                     api_key: str,
+                     stream_configuration_template_id: str,
+                     workers: int = 8,
+                     resolve_media: bool = False,
+                     head_timeout: float = 10) -> Iterator[dict]:
+    """
+    Yields the result of every link as soon as its transcription is done. The first link of each group of duplicates
+    is the one submitted and carries the export, the others reference it.
+    """
+    assert api_key, 'API_KEY is required'
+
+    # group the links by their normalized form, in the order they were given
+    groups: Dict[str, List[str]] = {}
+
+    for file_link in file_links:
+        file_link = file_link.strip()
+
+        if not file_link:
+            continue
+
+        try:
+            groups.setdefault(normalize_link(file_link), []).append(file_link)
+        except ValueError as e:
+            yield {'link': file_link, 'streamId': None, 'state': 'FAILED', 'error': f'Invalid link: {e}'}
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcriber')
+
+    # the consumer may stop early (e.g. Ctrl+C or a closed output), the links not started yet are dropped
+    try:
+        # merge the groups pointing to the same media
+        if resolve_media:
+            keys: List[str] = list(executor.map(lambda item: media_key(item[1][0], item[0], head_timeout), groups.items()))
+        else:
+            keys = list(groups)
+
+        unique_work: Dict[str, List[str]] = {}
+        for key, group in zip(keys, groups.values()):
+            unique_work.setdefault(key, []).extend(group)
+
+        print(f'Links: {sum(len(group) for group in groups.values())}, unique: {len(unique_work)}', file=sys.stderr)
+
+        futures = {executor.submit(transcribe, group[0], api_key, stream_configuration_template_id): group
+                   for group in unique_work.values()}
+
+        for future in as_completed(futures):
+            group: List[str] = futures[future]
+
+            try:
+                result: dict = future.result()
+            except Exception as e:
+                result = {'streamId': None, 'state': 'FAILED', 'error': str(e)}
+
+            yield {'link': group[0], 'duplicates': len(group) - 1, **result}
+
+            # the duplicates reference the submitted link instead of repeating the export
+            for file_link in group[1:]:
+                yield {
+                    'link': file_link,
+                    'duplicateOf': group[0],
+                    **{key: value for key, value in result.items() if key != 'export'},
+                }
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Transcribe a batch of links using the Vatis API, each unique media is transcribed once')
+    parser.add_argument('--links-file', '-f', type=str, default='-', help='File with one link per line, defaults to stdin')
+    parser.add_argument('--output', '-o', type=str, default=None, help='JSON lines file with the result of each link, defaults to stdout')
+    parser.add_argument('--workers', '-w', type=int, default=8, help='Number of links transcribed concurrently')
+    parser.add_argument('--resolve-media', action='store_true', help='Detect duplicates using a HEAD request (ETag and Content-Length)')
+    args = parser.parse_args()
+
+    if args.links_file == '-':
+        links: List[str] = sys.stdin.read().splitlines()
+    else:
+        links_file = Path(args.links_file).resolve()
+
+        assert links_file.exists() and links_file.is_file(), f'File {links_file} does not exist or is not a file'
+
+        links = links_file.read_text().splitlines()
+
+    api_key: str = os.environ.get('API_KEY')
+    stream_configuration_template_id: str = os.environ.get('CONFIGURATION_ID', '668115d123bca7e3509723d4')
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+
+    try:
+        # each result is written as soon as it is available, so an interrupted batch keeps the completed links
+        for batch_result in transcribe_batch(file_links=links,
+                                             api_key=api_key,
+                                             stream_configuration_template_id=stream_configuration_template_id,
+                                             workers=args.workers,
+                                             resolve_media=args.resolve_media):
+            output.write(json.dumps(batch_result) + '\n')
+            output.flush()
+    finally:
+        if args.output:
+            output.close()
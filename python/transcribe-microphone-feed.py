@@ -1,25 +1,264 @@
 import json
 import os
+import struct
 import sys
 import threading
+import time
 import uuid
-from typing import Generator, Optional
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Generator, Optional
 import signal
 
-import websocket
-import pyaudio
+from audio_input import create_wav_headers, initialize_audio, select_input_device
+from transcript_deltas import StablePrefixTracker, TranscriptDelta
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    import websocket
+    import pyaudio
 
 # configuration #####
 BASE_URL: str = 'wss://ws-gateway.vatis.tech'
 DISPLAY_PARTIAL_FRAMES: bool = True
+SPOOL_MEMORY_LIMIT_BYTES: int = 4 * 1024 * 1024  # ~2 minutes of 16 kHz 16-bit mono audio, the rest is spilled to disk
+SPOOL_DIRECTORY: Optional[str] = None  # directory of the spill file, defaults to the system temporary directory
+SPOOL_REPORT_INTERVAL_SECONDS: float = 5
 # configuration end #####
 
 EOS = '{"type": "END_OF_STREAM"}'
 interrupted: bool = False
 final_transcript: str = ''
+partial_frames: StablePrefixTracker = StablePrefixTracker()
+
+
+class AudioSpool:
+    """
+    Bounded queue between the audio capture and the sender. Chunks over the memory limit are appended to a spill
+    file, and drained in order once the sender catches up, so a network stall neither blocks the capture nor loses audio.
+    The capture writes and the sender reads the spill file through separate handles, outside the lock.
+    """
+
+    HEADER = struct.Struct('<I')
+
+    def __init__(self, memory_limit_bytes: int = SPOOL_MEMORY_LIMIT_BYTES, directory: Optional[str] = SPOOL_DIRECTORY):
+        self.memory_limit_bytes: int = memory_limit_bytes
+        self.directory: Optional[str] = directory
+
+        self._memory: Deque[bytes] = deque()
+        self._memory_bytes: int = 0
+        self._spill_path: Optional[str] = None
+        self._spill_writer = None
+        self._spill_reader = None
+        self._spill_write_offset: int = 0
+        self._spill_read_offset: int = 0
+        # audio bytes in the spill file, without the chunk headers
+        self._disk_payload_bytes: int = 0
+        self._spilling: bool = False
+        self._writing: bool = False
+        self._closed: bool = False
+        self._aborted: bool = False
+        self._condition: threading.Condition = threading.Condition()
+
+        self.spilled_bytes: int = 0
+        self.sent_bytes: int = 0
+        self.lost_bytes: int = 0
+        self.max_memory_bytes: int = 0
+        self.max_disk_bytes: int = 0
+
+    def put(self, chunk: bytes) -> bool:
+        """
+        Returns `False` once the spool is aborted, the chunk is dropped.
+        """
+        with self._condition:
+            if self._aborted:
+                self.lost_bytes += len(chunk)
+                return False
+
+            # once spilling, keep appending to the file until it is drained, to preserve the order
+            if not self._spilling and self._memory_bytes + len(chunk) <= self.memory_limit_bytes:
+                self._memory.append(chunk)
+                self._memory_bytes += len(chunk)
+                self.max_memory_bytes = max(self.max_memory_bytes, self._memory_bytes)
+
+                self._condition.notify()
+
+                return True
+
+            if self._spill_writer is None:
+                self._open_spill_file()
+
+            # the file was drained, start over to keep it small
+            restart: bool = not self._spilling
+
+            if restart:
+                self._spill_write_offset = self._spill_read_offset = 0
+
+            self._spilling = self._writing = True
+
+        written: int = 0
+
+        try:
+            written = self._spill(chunk, restart)
+        finally:
+            # a single locked section, so abort() either counts the chunk with the file or leaves it to be counted here
+            with self._condition:
+                self._writing = False
+                accepted: bool = not self._aborted
+
+                if not accepted:
+                    self.lost_bytes += len(chunk)
+                elif written:
+                    self._spill_write_offset += written
+                    self._disk_payload_bytes += len(chunk)
+                    self.spilled_bytes += len(chunk)
+                    self.max_disk_bytes = max(self.max_disk_bytes, self._disk_payload_bytes)
+
+                self._condition.notify()
+
+        return accepted
+
+    def get(self) -> Optional[bytes]:
+        """
+        Blocks until a chunk is available. Returns `None` once the spool is closed and drained, or aborted.
+        """
+        with self._condition:
+            while not self._memory and not self._disk_bytes() and (self._writing or not self._closed):
+                self._condition.wait()
+
+            if self._aborted:
+                return None
+
+            if self._memory:
+                chunk: bytes = self._memory.popleft()
+                self._memory_bytes -= len(chunk)
+                self.sent_bytes += len(chunk)
+
+                return chunk
+
+            if not self._disk_bytes():
+                return None
+
+            read_offset: int = self._spill_read_offset
+
+        # only the sender moves the read offset, the capture keeps spilling meanwhile
+        chunk = self._unspill(read_offset)
+
+        with self._condition:
+            # aborted meanwhile, the chunk was counted as lost
+            if self._aborted:
+                return None
+
+            self._spill_read_offset += self.HEADER.size + len(chunk)
+            self._disk_payload_bytes -= len(chunk)
+            self.sent_bytes += len(chunk)
+
+            # drained, the next chunks go to the memory again
+            if not self._disk_bytes() and not self._writing:
+                self._spilling = False
+
+            return chunk
+
+    def close(self):
+        """
+        Called by the capture once there is no more audio, the sender drains the backlog.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        self._close_spill_file('_spill_writer')
+
+    def abort(self) -> int:
+        """
+        Called by the sender when it can't send anymore: drops the backlog and makes the capture stop.
+        Returns the number of bytes lost so far.
+        """
+        with self._condition:
+            self._aborted = self._closed = True
+            self.lost_bytes += self._memory_bytes + self._disk_payload_bytes
+
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._spill_read_offset = self._spill_write_offset
+            self._disk_payload_bytes = 0
+
+            self._condition.notify_all()
+
+            return self.lost_bytes
+
+    def __iter__(self) -> Generator[bytes, None, None]:
+        try:
+            while (chunk := self.get()) is not None:
+                yield chunk
+        finally:
+            self._close_spill_file('_spill_reader')
+
+    def metrics(self) -> dict:
+        with self._condition:
+            return {
+                'memoryChunks': len(self._memory),
+                'memoryBytes': self._memory_bytes,
+                'diskBytes': self._disk_payload_bytes,
+                'spilledBytes': self.spilled_bytes,
+                'sentBytes': self.sent_bytes,
+                'lostBytes': self.lost_bytes,
+                'maxMemoryBytes': self.max_memory_bytes,
+                'maxDiskBytes': self.max_disk_bytes,
+            }
+
+    def _disk_bytes(self) -> int:
+        # the chunks left in the spill file, headers included
+        return self._spill_write_offset - self._spill_read_offset
+
+    def _open_spill_file(self):
+        import tempfile
+
+        file_descriptor, self._spill_path = tempfile.mkstemp(prefix='vatis-audio-spool-', dir=self.directory)
+
+        self._spill_writer = os.fdopen(file_descriptor, 'wb')
+        self._spill_reader = open(self._spill_path, 'rb')
+
+    def _close_spill_file(self, handle_name: str):
+        with self._condition:
+            handle = getattr(self, handle_name)
+
+            if handle is None:
+                return
+
+            setattr(self, handle_name, None)
+
+            # the last side to finish removes the file
+            remove: bool = self._spill_writer is None and self._spill_reader is None
+
+        handle.close()
+
+        if remove:
+            os.remove(self._spill_path)
+
+    def _spill(self, chunk: bytes, restart: bool) -> int:
+        if restart:
+            self._spill_writer.seek(0)
+            self._spill_writer.truncate()
+
+        self._spill_writer.write(self.HEADER.pack(len(chunk)))
+        self._spill_writer.write(chunk)
+
+        # make the chunk visible to the reader handle
+        self._spill_writer.flush()
+
+        return self.HEADER.size + len(chunk)
+
+    def _unspill(self, read_offset: int) -> bytes:
+        self._spill_reader.seek(read_offset)
+        size: int = self.HEADER.unpack(self._spill_reader.read(self.HEADER.size))[0]
+
+        return self._spill_reader.read(size)
 
 
 def transcribe(stream_generator: Generator[bytes, None, None], api_key: str, stream_configuration_template_id: str):
+    import websocket
+
     assert api_key, 'API_KEY is required'
 
     stream_id: str = str(uuid.uuid4())
@@ -49,17 +288,47 @@ def transcribe(stream_generator: Generator[bytes, None, None], api_key: str, str
     connection.run_forever(ping_interval=5)
 
 
-def on_open(ws: websocket.WebSocket, stream_generator: Generator[bytes, None, None]):
+def on_open(ws: 'websocket.WebSocket', stream_generator: Generator[bytes, None, None]):
+    spool: AudioSpool = AudioSpool()
+
+    def _capture_data():
+        last_report: float = time.monotonic()
+
+        try:
+            for data in stream_generator:
+                # the sender gave up, stop the recording
+                if not spool.put(data):
+                    stream_generator.close()
+                    break
+
+                # report the backlog while the sender is behind
+                if time.monotonic() - last_report > SPOOL_REPORT_INTERVAL_SECONDS:
+                    last_report = time.monotonic()
+                    metrics: dict = spool.metrics()
+
+                    if metrics['memoryBytes'] or metrics['diskBytes']:
+                        print(f'Audio spool: {metrics}', flush=True)
+        finally:
+            spool.close()
+
     def _send_data():
-        for data in stream_generator:
-            ws.send_bytes(data)
+        try:
+            # the backlog is sent as fast as the connection allows
+            for data in spool:
+                ws.send_bytes(data)
 
-        ws.send_text(EOS)
+            ws.send_text(EOS)
+        except Exception as e:
+            lost_bytes: int = spool.abort()
+            print(f'Error sending audio, recording stopped: {e} ({lost_bytes} bytes of audio not sent)', flush=True)
 
+        print(f'Audio spool: {spool.metrics()}', flush=True)
+
+    threading.Thread(target=_capture_data, name='data-capture', daemon=True).start()
     threading.Thread(target=_send_data, name='data-sender', daemon=True).start()
 
 
-def on_message(ws: websocket.WebSocket, event_json: str):
+def on_message(ws: 'websocket.WebSocket', event_json: str):
     if not event_json:
         return
 
@@ -85,66 +354,30 @@ def print_transcription(event: dict, display_all: bool = False):
 
     assert event['payloadSchema'] == 'tech.vatis.schema.stream.processor.messages.transcription.TranscriptionResponseDto', f'Not a transcription event: {event}'
 
-    # filter out partial frames, display only the final results
-    if event['frameType'] == 'final' or display_all:
-        transcript: str = event['payload']['transcription']
-        start_time: int = event['payload']['start'] / 1000
-        end_time: int = event['payload']['end'] / 1000
-        frame_type: str = event['frameType']
-
-        if frame_type == 'final':
-            final_transcript += transcript
-
-        formatted_start: str = f'{start_time:.2f}'
-        formatted_end: str = f'{end_time:.2f}'
-        print(f'{formatted_start:>6} - {formatted_end:<6} - {frame_type:<7}: {transcript}', flush=True)
-
-
-def create_wav_headers(channels: int, sample_rate: int, sample_width: int) -> bytes:
-    import wave
-    import io
-
-    buffer = io.BytesIO()
-
-    with wave.open(buffer, 'wb') as wav_file:
-        wav_file.setnchannels(channels)
-        wav_file.setsampwidth(sample_width)
-        wav_file.setframerate(sample_rate)
-        wav_file.setnframes(0)
-
-    return buffer.getvalue()
+    delta: Optional[TranscriptDelta] = partial_frames.update(event)
 
+    # the partial frame repeats the previous hypothesis
+    if delta is None:
+        return
 
-def select_input_device(pa: pyaudio.PyAudio) -> int:
-    info = pa.get_host_api_info_by_index(0)
-    numdevices: int = info.get('deviceCount')
+    if delta.frame_type == 'final':
+        final_transcript += delta.transcript
 
-    default_input_device: Optional = pa.get_default_input_device_info()
-    default_input_device_index: Optional[int] = None
+    formatted_start: str = f'{delta.start / 1000:.2f}'
+    formatted_end: str = f'{delta.end / 1000:.2f}'
 
-    if default_input_device:
-        default_input_device_index = default_input_device.get('index')
+    # with partial frames, display only the changed tail of the hypothesis
+    if display_all:
+        print(f'{formatted_start:>6} - {formatted_end:<6} - {delta.action:<7} @{delta.offset:<4}: {delta.text}', flush=True)
+    elif delta.frame_type == 'final':
+        print(f'{formatted_start:>6} - {formatted_end:<6} - {delta.frame_type:<7}: {delta.transcript}', flush=True)
 
-    for i in range(0, numdevices):
-        if (pa.get_device_info_by_index(i).get('maxInputChannels')) > 0:
-            print("Input Device index ",
-                  i,
-                  " - ",
-                  pa.get_device_info_by_index(i).get('name'),
-                  ' (default)' if i == default_input_device_index else '')
 
-    index = input('Select input device index: ')
+def stream_microphone(audio: 'Future[pyaudio.PyAudio]', input_device_index: int, chunk_size: int = 1024) -> Generator[bytes, None, None]:
+    import pyaudio
 
-    if not index:
-        if default_input_device_index:
-            return default_input_device_index
-        else:
-            raise ValueError('No input device selected')
-    else:
-        return int(index)
+    p: pyaudio.PyAudio = audio.result()
 
-
-def stream_microphone(p: pyaudio.PyAudio, input_device_index: int, chunk_size: int = 1024) -> Generator[bytes, None, None]:
     sample_format = pyaudio.paInt16
     channels: int = 1
     sample_rate: int = 16000
@@ -189,13 +422,14 @@ if __name__ == '__main__':
 
     signal.signal(signal.SIGINT, signal_handler)
 
-    p = pyaudio.PyAudio()
+    audio = initialize_audio()
 
-    input_device_index = select_input_device(p)
+    input_device_index = select_input_device(audio)
 
     try:
-        transcribe(stream_generator=stream_microphone(p, input_device_index),
+        transcribe(stream_generator=stream_microphone(audio, input_device_index),
                    api_key=api_key,
                    stream_configuration_template_id=stream_configuration_template_id)
     finally:
-        p.terminate()
+        if audio.done() and audio.exception() is None:
+            audio.result().terminate()
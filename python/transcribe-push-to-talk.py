@@ -0,0 +1,375 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Generator, List, Optional
+
+from audio_input import create_wav_headers, initialize_audio, select_input_device
+from transcript_deltas import StablePrefixTracker, TranscriptDelta
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    import websocket
+    import pyaudio
+
+# configuration #####
+BASE_URL: str = 'wss://ws-gateway.vatis.tech'
+DISPLAY_PARTIAL_FRAMES: bool = True
+POOL_SIZE: int = int(os.environ.get('POOL_SIZE', '2'))  # number of authenticated connections kept open
+MAX_IDLE_SECONDS: float = 30  # connections without a successful health check for this long are replaced
+MAX_CONNECTION_AGE_SECONDS: float = 300  # connections older than this are replaced, even when healthy
+HEALTH_CHECK_INTERVAL_SECONDS: float = 5
+HEALTH_CHECK_TIMEOUT_SECONDS: float = 2
+# configuration end #####
+
+EOS = '{"type": "END_OF_STREAM"}'
+final_transcript: str = ''
+partial_frames: StablePrefixTracker = StablePrefixTracker()
+
+
+class PooledConnection:
+    def __init__(self, ws: 'websocket.WebSocket', stream_id: str):
+        self.ws: 'websocket.WebSocket' = ws
+        self.stream_id: str = stream_id
+        self.created_at: float = time.monotonic()
+        # last time the server answered, refreshed by every successful health check
+        self.last_active_at: float = self.created_at
+        # messages received while idle (e.g. the stream metadata), replayed when the session starts
+        self.pending_messages: List[str] = []
+
+    def is_expired(self, max_idle_seconds: float, max_age_seconds: float) -> bool:
+        now: float = time.monotonic()
+
+        return now - self.last_active_at > max_idle_seconds or now - self.created_at > max_age_seconds
+
+    def is_healthy(self, timeout: float) -> bool:
+        import websocket
+
+        try:
+            self.ws.settimeout(timeout)
+            self.ws.ping()
+
+            while True:
+                opcode, frame = self.ws.recv_data_frame(True)
+
+                if opcode == websocket.ABNF.OPCODE_PONG:
+                    self.last_active_at = time.monotonic()
+                    return True
+                elif opcode == websocket.ABNF.OPCODE_TEXT:
+                    self.pending_messages.append(frame.data.decode('utf-8'))
+                elif opcode == websocket.ABNF.OPCODE_CLOSE:
+                    return False
+        except Exception:
+            return False
+        finally:
+            if self.ws.connected:
+                self.ws.settimeout(None)
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Keeps a number of authenticated connections open, so a session doesn't pay for the TLS and auth handshake.
+    Each connection carries its own stream id and is used for a single session.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 stream_configuration_template_id: str,
+                 size: int = POOL_SIZE,
+                 max_idle_seconds: float = MAX_IDLE_SECONDS,
+                 max_age_seconds: float = MAX_CONNECTION_AGE_SECONDS,
+                 health_check_interval_seconds: float = HEALTH_CHECK_INTERVAL_SECONDS):
+        assert api_key, 'API_KEY is required'
+        assert size > 0, 'The pool size must be positive'
+
+        self.api_key: str = api_key
+        self.stream_configuration_template_id: str = stream_configuration_template_id
+        self.size: int = size
+        self.max_idle_seconds: float = max_idle_seconds
+        self.max_age_seconds: float = max_age_seconds
+        self.health_check_interval_seconds: float = health_check_interval_seconds
+
+        self._idle: Deque[PooledConnection] = deque()
+        self._lock: threading.Lock = threading.Lock()
+        self._closed: threading.Event = threading.Event()
+        self._maintainer: Optional[threading.Thread] = None
+
+    def start(self):
+        self._maintainer = threading.Thread(target=self._maintain, name='pool-maintainer', daemon=True)
+        self._maintainer.start()
+
+    def acquire(self) -> PooledConnection:
+        with self._lock:
+            connection: Optional[PooledConnection] = self._idle.popleft() if self._idle else None
+
+        # the pool is drained, fall back to connecting on demand
+        if connection is None or connection.is_expired(self.max_idle_seconds, self.max_age_seconds) or not connection.ws.connected:
+            if connection is not None:
+                connection.close()
+            connection = self._connect()
+
+        return connection
+
+    def close(self):
+        self._closed.set()
+
+        with self._lock:
+            while self._idle:
+                self._idle.popleft().close()
+
+    def _connect(self) -> PooledConnection:
+        import websocket
+
+        stream_id: str = str(uuid.uuid4())
+
+        # configuration options here
+        parameters = {
+            'id': stream_id,
+            'streamConfigurationTemplateId': self.stream_configuration_template_id,
+            'language': 'en',  # set the language here
+        }
+
+        # authentication headers
+        headers = {
+            'Authorization': f'Basic {self.api_key}',
+        }
+
+        ws: websocket.WebSocket = websocket.create_connection(
+            f'{BASE_URL}/ws-gateway/api/v1/?{"&".join([f"{k}={v}" for k, v in parameters.items()])}',
+            header=headers,
+            enable_multithread=True,
+        )
+
+        return PooledConnection(ws, stream_id)
+
+    def _maintain(self):
+        while not self._closed.is_set():
+            with self._lock:
+                idle: List[PooledConnection] = list(self._idle)
+
+            # check one connection at a time, so the others remain available to the sessions
+            for connection in reversed(idle):
+                with self._lock:
+                    if connection not in self._idle:
+                        continue  # already handed out to a session
+                    self._idle.remove(connection)
+
+                healthy: bool = not connection.is_expired(self.max_idle_seconds, self.max_age_seconds) and connection.is_healthy(HEALTH_CHECK_TIMEOUT_SECONDS)
+
+                with self._lock:
+                    if healthy and not self._closed.is_set():
+                        # keep the oldest connections first
+                        self._idle.appendleft(connection)
+                        continue
+
+                connection.close()
+
+            with self._lock:
+                missing: int = self.size - len(self._idle)
+
+            for _ in range(missing):
+                try:
+                    connection = self._connect()
+                except Exception as e:
+                    print(f'Error on pool connection: {e}')
+                    break
+
+                with self._lock:
+                    if self._closed.is_set():
+                        connection.close()
+                        return
+
+                    self._idle.append(connection)
+
+            self._closed.wait(self.health_check_interval_seconds)
+
+
+def transcribe(connection: PooledConnection, stream_generator: Generator[bytes, None, None]):
+    import websocket
+
+    global final_transcript, partial_frames
+    final_transcript = ''
+    partial_frames = StablePrefixTracker()
+
+    def _send_data():
+        try:
+            for data in stream_generator:
+                connection.ws.send_bytes(data)
+
+            connection.ws.send_text(EOS)
+        except websocket.WebSocketConnectionClosedException:
+            pass
+
+    threading.Thread(target=_send_data, name='data-sender', daemon=True).start()
+
+    for event_json in connection.pending_messages:
+        on_message(connection.ws, event_json)
+
+    try:
+        while connection.ws.connected:
+            on_message(connection.ws, connection.ws.recv())
+    except websocket.WebSocketConnectionClosedException:
+        pass
+    except Exception as e:
+        print(f'Error: {e}')
+    finally:
+        connection.close()
+
+    print(f'\nTranscription:\n\n{final_transcript}\n')
+
+
+def on_message(ws: 'websocket.WebSocket', event_json: str):
+    if not event_json:
+        return
+
+    event: dict = json.loads(event_json)
+
+    if event['type'] == 'RESPONSE':
+        try:
+            print_transcription(event['response'], display_all=DISPLAY_PARTIAL_FRAMES)
+        except Exception as e:
+            print(f'Error processing response: {e}')
+    elif event['type'] == 'ERROR':
+        print(f'Error: {event["error"]}')
+    elif event['type'] == 'STREAM_METADATA':
+        print(f'Stream id: {event["stream"]["streamId"]}\n')
+    elif event['type'] == 'END_OF_STREAM':
+        ws.close()
+    else:
+        print(f'Unknown event: {event}')
+
+
+def print_transcription(event: dict, display_all: bool = False):
+    global final_transcript
+
+    assert event['payloadSchema'] == 'tech.vatis.schema.stream.processor.messages.transcription.TranscriptionResponseDto', f'Not a transcription event: {event}'
+
+    delta: Optional[TranscriptDelta] = partial_frames.update(event)
+
+    # the partial frame repeats the previous hypothesis
+    if delta is None:
+        return
+
+    if delta.frame_type == 'final':
+        final_transcript += delta.transcript
+
+    formatted_start: str = f'{delta.start / 1000:.2f}'
+    formatted_end: str = f'{delta.end / 1000:.2f}'
+
+    # with partial frames, display only the changed tail of the hypothesis
+    if display_all:
+        print(f'{formatted_start:>6} - {formatted_end:<6} - {delta.action:<7} @{delta.offset:<4}: {delta.text}', flush=True)
+    elif delta.frame_type == 'final':
+        print(f'{formatted_start:>6} - {formatted_end:<6} - {delta.frame_type:<7}: {delta.transcript}', flush=True)
+
+
+def stream_microphone(p: 'pyaudio.PyAudio',
+                      input_device_index: int,
+                      stop_event: threading.Event,
+                      chunk_size: int = 1024) -> Generator[bytes, None, None]:
+    import pyaudio
+
+    sample_format = pyaudio.paInt16
+    channels: int = 1
+    sample_rate: int = 16000
+    sample_width: int = pyaudio.get_sample_size(sample_format)
+
+    stream = p.open(format=sample_format,
+                    channels=channels,
+                    rate=sample_rate,
+                    input=True,
+                    frames_per_buffer=chunk_size,
+                    input_device_index=input_device_index)
+
+    try:
+        yield create_wav_headers(channels, sample_rate, sample_width)
+
+        print('Recording started, press Enter to stop')
+
+        while not stop_event.is_set():
+            data = stream.read(chunk_size)
+            yield data
+
+        print('Recording stopped')
+    finally:
+        stream.stop_stream()
+        stream.close()
+
+
+def read_key_presses(key_presses: 'queue.Queue[Optional[str]]'):
+    for line in sys.stdin:
+        key_presses.put(line)
+
+    # end of input
+    key_presses.put(None)
+
+
+def wait_for_stop(key_presses: 'queue.Queue[Optional[str]]', stop_event: threading.Event):
+    while not stop_event.is_set():
+        try:
+            key_presses.get(timeout=0.2)
+        except queue.Empty:
+            continue
+
+        stop_event.set()
+
+
+if __name__ == '__main__':
+    api_key: str = os.environ.get('API_KEY')
+    stream_configuration_template_id: str = os.environ.get('CONFIGURATION_ID', '670ba9e0efa59fe6aecd56f1')
+
+    # warm up the connections while the audio device is being selected
+    pool = ConnectionPool(api_key=api_key, stream_configuration_template_id=stream_configuration_template_id)
+    pool.start()
+
+    audio: 'Future[pyaudio.PyAudio]' = initialize_audio()
+
+    try:
+        input_device_index = select_input_device(audio)
+        p: 'pyaudio.PyAudio' = audio.result()
+
+        # a single reader owns stdin, so a session that ends before Enter doesn't leave a reader behind
+        key_presses: 'queue.Queue[Optional[str]]' = queue.Queue()
+        threading.Thread(target=read_key_presses, args=(key_presses,), name='stdin-reader', daemon=True).start()
+
+        while True:
+            # drop the presses made while no session was waiting for them
+            while not key_presses.empty():
+                key_presses.get_nowait()
+
+            print('Press Enter to talk (Ctrl+C to exit)', flush=True)
+
+            if key_presses.get() is None:
+                break
+
+            started: float = time.perf_counter()
+            session_connection: PooledConnection = pool.acquire()
+            print(f'Connection ready in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+            stop_event: threading.Event = threading.Event()
+            threading.Thread(target=wait_for_stop, args=(key_presses, stop_event), name='push-to-talk', daemon=True).start()
+
+            try:
+                transcribe(connection=session_connection,
+                           stream_generator=stream_microphone(p, input_device_index, stop_event))
+            finally:
+                # releases the watcher when the server closed the session first
+                stop_event.set()
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        pool.close()
+
+        if audio.done() and audio.exception() is None:
+            audio.result().terminate()
@@ -0,0 +1,330 @@
+import json
+import re
+import sqlite3
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# configuration #####
+INDEX_PATH: str = 'transcripts.index'
+WORD_KEYS: Tuple[str, ...] = ('word', 'text', 'value')
+START_KEYS: Tuple[str, ...] = ('start', 'startTime')
+END_KEYS: Tuple[str, ...] = ('end', 'endTime')
+PREFERRED_WORDS_KEY: str = 'enhancedTranscription'  # indexed instead of the other word lists of the same stream
+TIME_TO_MS: float = 1  # multiplier applied to the exported timestamps to get milliseconds
+# configuration end #####
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+
+# a word occurrence: (position in the stream, start ms, end ms)
+Occurrence = Tuple[int, int, int]
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def encode_varints(values: Iterable[int]) -> bytes:
+    buffer = bytearray()
+
+    for value in values:
+        while value >= 0x80:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    return bytes(buffer)
+
+
+def decode_varints(data: bytes) -> Iterator[int]:
+    value: int = 0
+    shift: int = 0
+
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            yield value
+            value = 0
+            shift = 0
+
+
+def encode_postings(occurrences: List[Occurrence]) -> bytes:
+    # delta encoded positions and start times, durations stored as is
+    values: List[int] = []
+    previous_position: int = 0
+    previous_start: int = 0
+
+    for position, start, end in occurrences:
+        values.extend((position - previous_position, start - previous_start, end - start))
+        previous_position, previous_start = position, start
+
+    return encode_varints(values)
+
+
+def decode_postings(data: bytes) -> List[Occurrence]:
+    values: List[int] = list(decode_varints(data))
+    occurrences: List[Occurrence] = []
+    position: int = 0
+    start: int = 0
+
+    for i in range(0, len(values), 3):
+        position += values[i]
+        start += values[i + 1]
+        occurrences.append((position, start, start + values[i + 2]))
+
+    return occurrences
+
+
+def _first(item: dict, keys: Tuple[str, ...]):
+    for key in keys:
+        if key in item:
+            return item[key]
+
+    return None
+
+
+def extract_words(export, stream_id: Optional[str] = None) -> Dict[str, List[Tuple[str, int, int]]]:
+    """
+    Collects the timed words of each stream in an export. An object with a word and a start/end time is a word when no
+    timed words are nested inside it, and it belongs to the closest enclosing object with a `streamId`.
+    The words are grouped by their path in the export, and a single word list is kept for each stream: the one under
+    `PREFERRED_WORDS_KEY` if present (e.g. the enhanced words next to the plain ones), otherwise the first one.
+    """
+    # word lists of each stream, keyed by the path of object keys leading to them
+    word_lists: Dict[str, Dict[Tuple[str, ...], List[Tuple[str, int, int]]]] = defaultdict(dict)
+
+    def _walk(node, current_stream_id: Optional[str], path: Tuple[str, ...]) -> bool:
+        # returns whether timed words were found at or below the node
+        if isinstance(node, dict):
+            current_stream_id = node.get('streamId', current_stream_id)
+
+            nested: bool = False
+
+            for key, value in node.items():
+                nested |= _walk(value, current_stream_id, path + (key,))
+
+            if nested:
+                return True
+
+            word = _first(node, WORD_KEYS)
+            start = _first(node, START_KEYS)
+            end = _first(node, END_KEYS)
+
+            if isinstance(word, str) and isinstance(start, (int, float)) and isinstance(end, (int, float)) and current_stream_id:
+                word_lists[current_stream_id].setdefault(path, []).append((word, int(start * TIME_TO_MS), int(end * TIME_TO_MS)))
+                return True
+        elif isinstance(node, list):
+            nested = False
+
+            for value in node:
+                nested |= _walk(value, current_stream_id, path)
+
+            return nested
+
+        return False
+
+    _walk(export, stream_id, ())
+
+    words: Dict[str, List[Tuple[str, int, int]]] = {}
+
+    for word_stream_id, lists in word_lists.items():
+        preferred: List[Tuple[str, ...]] = [path for path in lists if PREFERRED_WORDS_KEY in path]
+        words[word_stream_id] = lists[preferred[0] if preferred else next(iter(lists))]
+
+    return words
+
+
+class TranscriptIndex:
+    def __init__(self, path: str = INDEX_PATH):
+        self.connection: sqlite3.Connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS streams (id INTEGER PRIMARY KEY, stream_id TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, stream INTEGER NOT NULL, data BLOB NOT NULL,
+                                                 PRIMARY KEY (term, stream)) WITHOUT ROWID;
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, export, stream_id: Optional[str] = None) -> List[str]:
+        """
+        Indexes the streams of an export, the streams already in the index are skipped. Returns the indexed stream ids.
+        """
+        indexed: List[str] = []
+
+        with self.connection:
+            for export_stream_id, words in extract_words(export, stream_id).items():
+                cursor = self.connection.execute('INSERT OR IGNORE INTO streams (stream_id) VALUES (?)', (export_stream_id,))
+
+                if not cursor.rowcount:
+                    continue
+
+                stream: int = cursor.lastrowid
+                postings: Dict[str, List[Occurrence]] = defaultdict(list)
+                position: int = 0
+
+                for word, start, end in sorted(words, key=lambda item: item[1]):
+                    # a word may contain several tokens (e.g. "state-of-the-art"), they share the timings
+                    for term in tokenize(word):
+                        postings[term].append((position, start, end))
+                        position += 1
+
+                self.connection.executemany('INSERT INTO postings (term, stream, data) VALUES (?, ?, ?)',
+                                            ((term, stream, encode_postings(occurrences)) for term, occurrences in postings.items()))
+
+                indexed.append(export_stream_id)
+
+        return indexed
+
+    def _posting_counts(self, terms: Iterable[str]) -> Dict[str, int]:
+        # number of streams containing each term, read from the primary key without decoding the postings
+        terms = list(set(terms))
+        rows = self.connection.execute(f'SELECT term, COUNT(*) FROM postings WHERE term IN ({",".join("?" * len(terms))}) GROUP BY term', terms)
+        return dict(rows)
+
+    def _postings(self, term: str, streams: Optional[Set[int]] = None) -> Dict[int, List[Occurrence]]:
+        if streams is None:
+            rows = self.connection.execute('SELECT stream, data FROM postings WHERE term = ?', (term,))
+            return {stream: decode_postings(data) for stream, data in rows}
+
+        streams = sorted(streams)
+        postings: Dict[int, List[Occurrence]] = {}
+
+        # only the candidate streams, staying below the sqlite host parameters limit
+        for i in range(0, len(streams), 500):
+            chunk = streams[i:i + 500]
+            rows = self.connection.execute(f'SELECT stream, data FROM postings WHERE term = ? AND stream IN ({",".join("?" * len(chunk))})', (term, *chunk))
+            postings.update((stream, decode_postings(data)) for stream, data in rows)
+
+        return postings
+
+    def _stream_ids(self, streams: Iterable[int]) -> Dict[int, str]:
+        streams = list(streams)
+        stream_ids: Dict[int, str] = {}
+
+        # stay below the sqlite host parameters limit
+        for i in range(0, len(streams), 500):
+            chunk = streams[i:i + 500]
+            rows = self.connection.execute(f'SELECT id, stream_id FROM streams WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+            stream_ids.update(rows)
+
+        return stream_ids
+
+    def search_phrase(self, phrase: str, candidates: Optional[Set[int]] = None) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        Searches the streams containing the phrase, restricted to the `candidates` streams if given.
+        """
+        terms: List[str] = tokenize(phrase)
+
+        if not terms:
+            return {}
+
+        counts: Dict[str, int] = self._posting_counts(terms)
+
+        # a stream must contain every term of the phrase, start from the rarest one and fetch the postings of the
+        # others only for the streams still matching
+        postings: Dict[str, Dict[int, List[Occurrence]]] = {}
+
+        for term in sorted(set(terms), key=lambda term: counts.get(term, 0)):
+            if not counts.get(term) or candidates is not None and not candidates:
+                return {}
+
+            postings[term] = self._postings(term, candidates)
+            candidates = set(postings[term])
+
+        hits: Dict[int, List[Tuple[int, int]]] = {}
+
+        for stream in candidates:
+            positions: List[Dict[int, Occurrence]] = [{occurrence[0]: occurrence for occurrence in postings[term][stream]}
+                                                      for term in terms]
+            matches: List[Tuple[int, int]] = []
+
+            for position, start, _ in postings[terms[0]][stream]:
+                if all(position + offset in positions[offset] for offset in range(1, len(terms))):
+                    matches.append((start, positions[-1][position + len(terms) - 1][2]))
+
+            if matches:
+                hits[stream] = matches
+
+        return hits
+
+    def search(self, query: str) -> Dict[str, Dict[str, List[Tuple[int, int]]]]:
+        """
+        Searches the streams containing all the keywords and quoted phrases of the query.
+        Returns the start/end offsets in milliseconds of each keyword/phrase, grouped by stream id.
+        """
+        phrases: List[str] = re.findall(r'"([^"]+)"', query)
+        keywords: List[str] = tokenize(re.sub(r'"[^"]+"', ' ', query))
+        clauses: List[str] = phrases + keywords
+
+        if not clauses:
+            return {}
+
+        counts: Dict[str, int] = self._posting_counts(term for clause in clauses for term in tokenize(clause))
+
+        # the clause with the rarest term first, the next clauses are searched only in the streams matching so far
+        clause_hits: Dict[str, Dict[int, List[Tuple[int, int]]]] = {}
+        streams: Optional[Set[int]] = None
+
+        for clause in sorted(clauses, key=lambda clause: min((counts.get(term, 0) for term in tokenize(clause)), default=0)):
+            clause_hits[clause] = self.search_phrase(clause, streams)
+            streams = set(clause_hits[clause])
+
+            if not streams:
+                return {}
+
+        stream_ids: Dict[int, str] = self._stream_ids(streams)
+
+        return {
+            stream_ids[stream]: {clause: clause_hits[clause][stream] for clause in clauses}
+            for stream in sorted(streams)
+        }
+
+
+def export_files(paths: List[str]) -> Iterator[Path]:
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.rglob('*.json'))
+        else:
+            yield path
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Index the exported transcripts and search them with time-coded results')
+    parser.add_argument('--index', '-i', type=str, default=INDEX_PATH, help='Path of the index file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = commands.add_parser('add', help='Add export JSON files to the index, the streams already indexed are skipped')
+    add_parser.add_argument('paths', type=str, nargs='+', help='Export JSON files or directories containing them')
+
+    search_parser = commands.add_parser('search', help='Search the streams containing all the keywords and "quoted phrases"')
+    search_parser.add_argument('query', type=str, help='The search query, e.g. \'refund "credit card"\'')
+
+    args = parser.parse_args()
+
+    index = TranscriptIndex(args.index)
+
+    try:
+        if args.command == 'add':
+            for export_file in export_files(args.paths):
+                try:
+                    # exports without a stream id are indexed under the file name
+                    stream_ids: List[str] = index.add(json.loads(export_file.read_text()), stream_id=export_file.stem)
+                except (OSError, ValueError) as e:
+                    print(f'Error on {export_file}: {e}', file=sys.stderr)
+                    continue
+
+                print(f'{export_file}: indexed {len(stream_ids)} stream(s)')
+        elif args.command == 'search':
+            for stream_id, clause_hits in index.search(args.query).items():
+                print(f'Stream id: {stream_id}')
+
+                for clause, hits in clause_hits.items():
+                    offsets: str = ', '.join(f'{start}-{end}' for start, end in hits)
+                    print(f'  {clause}: {offsets} ms')
+    finally:
+        index.close()
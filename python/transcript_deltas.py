@@ -0,0 +1,56 @@
+import os
+from typing import NamedTuple, Optional
+
+
+class TranscriptDelta(NamedTuple):
+    """
+    Change of the hypothesis of a window: keep the first `offset` characters of the previous hypothesis, drop the
+    `removed` characters after them and append `text`. A final delta commits the window.
+    """
+    frame_type: str
+    start: int
+    end: int
+    offset: int
+    removed: int
+    text: str
+    transcript: str
+
+    @property
+    def action(self) -> str:
+        if self.frame_type == 'final':
+            return 'commit'
+
+        return 'replace' if self.removed else 'append'
+
+
+class StablePrefixTracker:
+    """
+    Tracks the stable prefix between consecutive partial frames of the same window, so only the changed tail is emitted.
+    """
+
+    def __init__(self):
+        self.window_start: Optional[int] = None
+        self.hypothesis: str = ''
+
+    def update(self, event: dict) -> Optional[TranscriptDelta]:
+        transcript: str = event['payload']['transcription']
+        start: int = event['payload']['start']
+        end: int = event['payload']['end']
+        frame_type: str = event['frameType']
+
+        previous: str = self.hypothesis
+
+        # within the same window only the tail after the common prefix changes. When the window moves without a
+        # final frame, the pending hypothesis of the previous window is replaced entirely
+        offset: int = len(os.path.commonprefix((previous, transcript))) if start == self.window_start else 0
+        removed: int = len(previous) - offset
+        text: str = transcript[offset:]
+
+        if frame_type == 'final':
+            self.window_start, self.hypothesis = None, ''
+        elif not removed and not text:
+            return None
+        else:
+            self.window_start, self.hypothesis = start, transcript
+
+        return TranscriptDelta(frame_type, start, end, offset, removed, text, transcript)